@@ -0,0 +1,181 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import pandas as pd
+
+from data_loader import LOCAL_CSV, load_horses
+from horse_index import DamOffspringIndex, LineageIndex, cached_index
+from nick_stats import NickStats
+from pedigree_engine import PedigreeGraph
+from stallion_recomender import build_recommendation
+
+CSV_FIELDS = [
+    "Mare",
+    "Status",
+    "Rank",
+    "Sire (Father)",
+    "Top_Son_Earnings",
+    "Horse Registration Number",
+    "Birth Date",
+    "Pedigree Link",
+    "Record Basis",
+    "Starters",
+    "Earners",
+    "Median Earnings",
+    "Earnings per Starter",
+    "Relative",
+    "Relationship",
+    "Offspring",
+    "Offspring Earnings",
+    "Justification",
+]
+
+FAILED = "failed: "  # status prefix of mares whose recommendation raised
+
+_df = None
+
+
+def _plain(value):
+    # JSON/CSV friendly scalars: NaN -> None, timestamps -> ISO dates, numpy -> python
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.date().isoformat()
+    return value.item() if hasattr(value, "item") else value
+
+
+def _init_worker(loader_kwargs):
+    # With fork the parent's already-loaded frame is inherited (load_horses hits
+    # its process cache); with spawn each worker reads the Parquet snapshot once.
+    global _df
+    _df = load_horses(**loader_kwargs)
+    cached_index(LineageIndex, _df)
+    cached_index(DamOffspringIndex, _df)
+    cached_index(PedigreeGraph, _df)
+    cached_index(NickStats, _df)
+
+
+def _recommend(mare_name):
+    try:
+        recommendation = build_recommendation(_df, mare_name)
+    except Exception as e:
+        return {"mare": mare_name, "status": f"{FAILED}{e!r}", "stallions": []}
+    stallions = [{k: _plain(v) for k, v in s.items()} for s in recommendation["stallions"]]
+    return {"mare": mare_name, "status": recommendation["error"] or "ok", "stallions": stallions}
+
+
+def completed_mares(path, fmt):
+    # Mares already written by an earlier (possibly interrupted) run. Failed
+    # ones are not done: a resumed run retries them and appends the new result.
+    if not os.path.exists(path):
+        return set()
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "jsonl":
+            done = set()
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    if not str(record.get("status", "")).startswith(FAILED):
+                        done.add(record["mare"])
+                except (ValueError, KeyError, AttributeError):
+                    pass  # partial last line from a killed run
+            return done
+        return {row["Mare"] for row in csv.DictReader(f) if not (row.get("Status") or "").startswith(FAILED)}
+
+
+class ResultWriter:
+    def __init__(self, path, fmt, append):
+        new_file = not (append and os.path.exists(path) and os.path.getsize(path) > 0)
+        self.fmt = fmt
+        self.file = open(path, "a" if append else "w", newline="", encoding="utf-8")
+        if fmt == "csv":
+            self.writer = csv.DictWriter(self.file, fieldnames=CSV_FIELDS)
+            if new_file:
+                self.writer.writeheader()
+
+    def write(self, result):
+        if self.fmt == "jsonl":
+            self.file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        elif result["stallions"]:
+            for rank, stallion in enumerate(result["stallions"], start=1):
+                self.writer.writerow({"Mare": result["mare"], "Status": result["status"], "Rank": rank, **stallion})
+        else:
+            self.writer.writerow({"Mare": result["mare"], "Status": result["status"]})
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def run_batch(mare_names, output, fmt="jsonl", workers=None, resume=True, loader_kwargs=None, progress_every=100):
+    loader_kwargs = loader_kwargs or {}
+    workers = workers or os.cpu_count() or 1
+    # Load the shared frame and build its indexes before forking so workers inherit them.
+    _init_worker(loader_kwargs)
+    if mare_names is None:
+        mare_names = _df[_df["Horse Gender"] == "Mare"]["Horse Name"].dropna().unique().tolist()
+
+    done = completed_mares(output, fmt) if resume else set()
+    todo = [m for m in dict.fromkeys(mare_names) if m not in done]
+    print(f"🐎 {len(todo)} mares to process ({len(done)} already done)", file=sys.stderr)
+
+    writer = ResultWriter(output, fmt, append=resume)
+    start = time.time()
+    count = 0
+    try:
+        if workers == 1:
+            results = map(_recommend, todo)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(loader_kwargs,))
+            results = pool.imap_unordered(_recommend, todo, chunksize=16)
+        for result in results:
+            writer.write(result)
+            count += 1
+            if count % progress_every == 0:
+                elapsed = time.time() - start
+                print(f"   {count}/{len(todo)} mares — {count / elapsed:.1f} mares/s", file=sys.stderr)
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        writer.close()
+
+    elapsed = time.time() - start
+    rate = count / elapsed if elapsed > 0 else float("inf")
+    print(f"✅ {count} mares in {elapsed:.2f} seconds ({rate:.1f} mares/s) → {output}", file=sys.stderr)
+    return count, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch stallion recommendations for many mares.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--mares", help="text file with one mare name per line")
+    source.add_argument("--all", action="store_true", help="every mare in the registry")
+    parser.add_argument("--output", required=True, help="results file (.jsonl or .csv)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="defaults to the output file extension")
+    parser.add_argument("--workers", type=int, default=None, help="process pool size (default: CPU count, 1 = serial)")
+    parser.add_argument("--restart", action="store_true", help="overwrite the output instead of resuming it")
+    parser.add_argument("--data", default=LOCAL_CSV, help="path to Horse_Data_Cleaned.csv")
+    parser.add_argument("--offline", action="store_true", help="never download the dataset")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.output.lower().endswith(".csv") else "jsonl")
+    mare_names = None
+    if args.mares:
+        with open(args.mares, encoding="utf-8") as f:
+            mare_names = [line.strip() for line in f if line.strip()]
+
+    loader_kwargs = {"csv_path": args.data}
+    if args.offline:
+        loader_kwargs["offline"] = True
+    run_batch(mare_names, args.output, fmt, args.workers, not args.restart, loader_kwargs)
+
+
+if __name__ == "__main__":
+    main()
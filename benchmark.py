@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from data_loader import build_snapshot, compact_horses, parse_horse_columns, read_horse_csv, read_snapshot
+from delta_ingest import check_against_rebuild, ingest
+from horse_index import DamOffspringIndex, LineageIndex, NameIndex, cached_index
+from horse_store import build_store
+from nick_stats import NickStats
+from pedigree_engine import GRANDPARENT_COLUMNS, PedigreeGraph
+from relative_recommender import collect_relatives, find_relatives, iter_relatives
+from result_cache import ResultCache, result_key
+from stallion_recomender import build_recommendation
+from synthetic_data import generate_registry
+
+BASELINE = "benchmark_baseline.json"
+YEARS = (1960, 2020)  # generate_registry's default span, about 10 generations
+
+
+def measure(fn, trace_memory=True):
+    # (seconds, peak traced MB, result). Timing and tracing are separate runs,
+    # since tracemalloc slows allocation-heavy code down noticeably.
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    peak_mb = None
+    if trace_memory:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        fn()
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return seconds, peak_mb, result
+
+
+def query_mares(df, n_queries, seed=0):
+    # Same mares every run: a fixed sample of mares with a recorded sire.
+    mares = df[(df["Horse Gender"] == "Mare") & df["Sire (Father)"].notna()]["Horse Name"].to_numpy()
+    rng = np.random.default_rng(seed)
+    return [str(m) for m in rng.choice(mares, size=min(n_queries, len(mares)), replace=False)]
+
+
+def run_key(n_horses, years):
+    # Baseline key: the size alone for the default span, else size:first-last
+    return str(n_horses) if tuple(years) == YEARS else f"{n_horses}:{years[0]}-{years[1]}"
+
+
+def run_size(n_horses, n_queries, workdir, years=YEARS):
+    stages = {}
+
+    def record(name, fn, per=1, trace_memory=True):
+        seconds, peak_mb, result = measure(fn, trace_memory)
+        stages[name] = {"seconds": round(seconds / per, 6), "peak_mb": None if peak_mb is None else round(peak_mb, 2)}
+        return result
+
+    raw = record("generate", lambda: generate_registry(n_horses, 0, *years), trace_memory=False)
+    csv_path = os.path.join(workdir, f"horses_{run_key(n_horses, years)}.csv")
+    raw.to_csv(csv_path, index=False)
+
+    record("load_csv", lambda: read_horse_csv(csv_path))
+    record("build_store", lambda: build_store(csv_path, tempfile.mkdtemp(dir=workdir)))  # out-of-core, chunked
+    snapshot, _ = build_snapshot(csv_path, workdir)
+    df = record("load_snapshot", lambda: read_snapshot(snapshot, compact=False))
+    df = record("compact", lambda: compact_horses(df))
+    df.attrs.pop("content_hash", None)  # keep the result cache out of the timings
+    mares = query_mares(df, n_queries)
+
+    # CLI recommender (stallion_recomender)
+    def cli_indexes():
+        return [
+            LineageIndex(df), DamOffspringIndex(df), NameIndex(df), NameIndex(df, "Mare"), PedigreeGraph(df), NickStats(df)
+        ]
+
+    record("cli_index", cli_indexes)
+    for index in (LineageIndex, DamOffspringIndex, PedigreeGraph, NickStats):
+        cached_index(index, df)
+    cached_index(NameIndex, df)
+    cached_index(NameIndex, df, "Mare")
+    record("cli_query", lambda: [build_recommendation(df, m) for m in mares], per=len(mares))
+
+    # Streamlit recommender (relative_recommender.find_relatives)
+    offspring_index, pedigree_graph, mare_names, nick_stats = record(
+        "app_index", lambda: (DamOffspringIndex(df), PedigreeGraph(df), NameIndex(df, "Mare"), NickStats(df))
+    )
+    record(
+        "app_query",
+        lambda: [find_relatives(df, m, offspring_index, pedigree_graph, mare_names, 5, nick_stats) for m in mares],
+        per=len(mares),
+    )
+
+    # Kinship of the query mares with everyone on a fresh graph, so both runs
+    # start with a cold inbreeding cache (the peak is the working tables)
+    def kinship():
+        graph = PedigreeGraph(df)
+        return graph.kinship_with_many([graph.node(m) for m in mares])
+
+    record("kinship", kinship, per=len(mares))
+    return stages
+
+
+def brute_force_kinship(graph, depth=None):
+    # Reference kinship matrix over every horse by the textbook tabular method
+    # (with depth: paths of at most depth generations), without the path
+    # weights, inbreeding cache and descendant pruning PedigreeGraph uses.
+    n = len(graph.sire)
+    order = np.lexsort((np.arange(n), graph.generation))
+    sire, dam = np.where(graph.sire < 0, n, graph.sire), np.where(graph.dam < 0, n, graph.dam)
+    zero = np.zeros((n + 1, n + 1))
+    slabs = [np.zeros((n + 1, n + 1)) for _ in range(1 if depth is None else depth + 1)]
+    for d, table in enumerate(slabs):
+        pairs = table if depth is None else (slabs[d - 1] if d >= 1 else zero)
+        selfs = table if depth is None else (slabs[d - 2] if d >= 2 else zero)
+        for k, i in enumerate(order):
+            earlier = order[:k]
+            table[i, earlier] = table[earlier, i] = 0.5 * (pairs[sire[i], earlier] + pairs[dam[i], earlier])
+            table[i, i] = 0.5 * (1 + selfs[sire[i], dam[i]])
+    return slabs[-1][:n, :n]
+
+
+def check_kinship(n_horses=1500, first_year=1800, depths=(None, 4), n_queries=10):
+    # Kinship, inbreeding and relationship on a deep synthetic pedigree against
+    # brute_force_kinship(); returns (generations, failures)
+    df = compact_horses(generate_registry(n_horses, first_year=first_year))
+    failures = []
+    for depth in depths:
+        graph = PedigreeGraph(df, max_depth=depth)
+        reference = brute_force_kinship(graph, depth)
+        mares = [graph.node(m) for m in query_mares(df, n_queries)]
+        label = f"depth {depth}" if depth is not None else "whole graph"
+        if not np.allclose(graph.kinship_with_many(mares), reference[mares], rtol=0, atol=1e-12):
+            failures.append(f"kinship_with_many ({label})")
+        parents = [(graph.sire[v], graph.dam[v]) for v in mares]
+        inbreeding = [reference[s, d] if s >= 0 and d >= 0 else 0.0 for s, d in parents]
+        if not np.allclose([graph.inbreeding(v) for v in mares], inbreeding, rtol=0, atol=1e-12):
+            failures.append(f"inbreeding ({label})")
+        a, b = mares[0], mares[1]
+        expected = 2 * reference[a, b] / np.sqrt((1 + inbreeding[0]) * (1 + inbreeding[1]))
+        if not np.isclose(graph.relationship(a, b), expected, rtol=0, atol=1e-12):
+            failures.append(f"relationship ({label})")
+    return int(graph.generation.max()), failures
+
+
+def check_delta_relink(n_horses=3000, first_year=1900, n_queries=10):
+    # A delta row for a sire the registry only names (no row of his own, no
+    # grandparent slots in his foals' rows) gives an existing node parents, so
+    # kinship between existing horses changes. Caches app results for his
+    # daughters, ingests his row and returns what check_against_rebuild() finds.
+    raw = parse_horse_columns(generate_registry(n_horses, first_year=first_year))
+    with_parents = raw[raw["Sire (Father)"].notna()]["Horse Name"]
+    sire = raw["Sire (Father)"][raw["Sire (Father)"].isin(with_parents)].value_counts().index[0]
+    base = raw[raw["Horse Name"] != sire].reset_index(drop=True)
+    foals = base["Sire (Father)"] == sire
+    base.loc[foals, list(GRANDPARENT_COLUMNS["Sire (Father)"])] = None
+    df = compact_horses(base)
+    df.attrs["content_hash"] = "delta-relink-check"
+
+    # Only the app's indexes: a cached NickStats would be saved to Data/cache
+    cache = ResultCache()
+    graph, offspring_index, mare_names = (
+        cached_index(PedigreeGraph, df), cached_index(DamOffspringIndex, df), cached_index(NameIndex, df, "Mare")
+    )
+    daughters = df[foals & (df["Horse Gender"] == "Mare")]["Horse Name"].head(n_queries)
+    for name in daughters:
+        relatives = collect_relatives(iter_relatives(df, name, offspring_index, graph, mare_names))
+        cache.put(result_key("app", df, name, "kinship", graph.max_depth), relatives)
+
+    new_df, _ = ingest(df, raw[raw["Horse Name"] == sire].reset_index(drop=True), cache)
+    return check_against_rebuild(new_df, n_queries, cache)
+
+
+def compare(results, baseline, time_tolerance, memory_tolerance):
+    # Regressions: slower than baseline by more than the tolerance (plus 5 ms of
+    # timer noise) or a traced peak more than the tolerance (plus 1 MB) higher.
+    failures = []
+    for size, stages in results.items():
+        for stage, current in stages.items():
+            base = baseline.get(size, {}).get(stage)
+            if base is None or stage == "generate":
+                continue
+            if current["seconds"] > base["seconds"] * (1 + time_tolerance) + 0.005:
+                failures.append(f"{size} {stage}: {current['seconds']:.4f}s vs baseline {base['seconds']:.4f}s")
+            if current["peak_mb"] is not None and base.get("peak_mb") is not None:
+                if current["peak_mb"] > base["peak_mb"] * (1 + memory_tolerance) + 1:
+                    failures.append(f"{size} {stage}: {current['peak_mb']:.1f} MB vs baseline {base['peak_mb']:.1f} MB")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark both recommenders on synthetic registries.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000], help="e.g. 10000 100000 1000000")
+    parser.add_argument("--queries", type=int, default=20, help="mares per query stage")
+    parser.add_argument("--years", type=int, nargs=2, default=list(YEARS), metavar=("FIRST", "LAST"), help="birth years spanned")
+    # Deep pedigrees are where kinship cost shows: ~38 generations instead of
+    # ~10, with tens of thousands of ancestors behind the youngest mares
+    parser.add_argument("--deep-horses", type=int, default=100000, help="horses in the deep-pedigree run, 0 to skip")
+    parser.add_argument("--deep-years", type=int, nargs=2, default=[1800, 2020], metavar=("FIRST", "LAST"))
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--time-tolerance", type=float, default=0.5, help="allowed slowdown, 0.5 = +50%%")
+    parser.add_argument("--memory-tolerance", type=float, default=0.25)
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    generations, kinship_failures = check_kinship()
+    if kinship_failures:
+        print(f"❌ Kinship differs from a brute-force matrix on a {generations}-generation pedigree: {', '.join(kinship_failures)}")
+        return 1
+    print(f"✅ Kinship matches a brute-force matrix on a {generations}-generation pedigree")
+    delta_failures = check_delta_relink()
+    if delta_failures:
+        print(f"❌ Delta ingest differs from a full rebuild once a row-less sire gains parents: {', '.join(delta_failures)}")
+        return 1
+    print("✅ Delta ingest matches a full rebuild once a row-less sire gains parents")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        runs = [(size, args.years) for size in args.sizes]
+        if args.deep_horses:
+            runs.append((args.deep_horses, args.deep_years))
+        for size, years in runs:
+            key = run_key(size, years)
+            print(f"🐎 {size:,} horses born {years[0]}-{years[1]}")
+            results[key] = run_size(size, args.queries, workdir, years)
+            for stage, r in results[key].items():
+                peak = "" if r["peak_mb"] is None else f"{r['peak_mb']:>10.1f} MB"
+                print(f"   {stage:<14}{r['seconds']:>10.4f} s{peak}")
+    peak_rss = None
+    try:
+        import resource
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"Peak RSS: {peak_rss:.0f} MB")
+    except ImportError:
+        pass  # no resource module on Windows
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"results": results, "peak_rss_mb": peak_rss}, f, indent=2)
+
+    if args.update_baseline or not os.path.exists(args.baseline):
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"✅ Baseline written to {args.baseline}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    failures = compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+    for failure in failures:
+        print(f"❌ Regression: {failure}")
+    if not failures:
+        print("✅ No regressions against the baseline")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
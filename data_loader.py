@@ -0,0 +1,168 @@
+import glob
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import urllib.request
+
+import pandas as pd
+
+from pedigree_engine import PEDIGREE_COLUMNS
+
+DATA_URL = "https://drive.google.com/uc?id=14A-2Pz2ILnUB_hQF1PJ3EB073QcDhNsi&export=download"
+LOCAL_CSV = os.path.join("Data", "cleaned", "Horse_Data_Cleaned.csv")
+SNAPSHOT_DIR = os.path.join("Data", "cache")
+
+# ✅ Set STALLION_OFFLINE=1 to start without touching the network
+OFFLINE = os.environ.get("STALLION_OFFLINE", "").lower() in ("1", "true", "yes")
+# ✅ Set STALLION_OUT_OF_CORE=1 to stream the CSV into a memory-mapped store
+# (horse_store.py) instead of loading the whole table into memory
+OUT_OF_CORE = os.environ.get("STALLION_OUT_OF_CORE", "").lower() in ("1", "true", "yes")
+
+# Every column holding a horse name; they all share one categorical vocabulary.
+NAME_COLUMNS = [
+    "Horse Name",
+    *PEDIGREE_COLUMNS,
+    "Great Granddam (Sire's Dam)",
+]
+
+logger = logging.getLogger(__name__)
+_loaded = {}
+_lock = threading.Lock()
+
+
+def content_hash(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def dataset_version(df):
+    return df.attrs.get("content_hash")
+
+
+def download_csv(url=DATA_URL, path=LOCAL_CSV):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".part"
+    with urllib.request.urlopen(url) as response, open(tmp, "wb") as f:
+        shutil.copyfileobj(response, f)
+    os.replace(tmp, path)
+
+
+def parse_horse_columns(df):
+    # Typed columns shared by full files and partial update files
+    if "Birth Date" in df.columns:
+        df["Birth Date"] = pd.to_datetime(df["Birth Date"], errors="coerce")
+    if "Total Earnings (USD)" in df.columns:
+        df["Total Earnings (USD)"] = pd.to_numeric(df["Total Earnings (USD)"], errors="coerce")
+    return df
+
+
+def read_horse_csv(path):
+    return parse_horse_columns(pd.read_csv(path, low_memory=False))
+
+
+def snapshot_path(version, snapshot_dir=SNAPSHOT_DIR):
+    return os.path.join(snapshot_dir, f"horses-{version}.parquet")
+
+
+def latest_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    snapshots = glob.glob(os.path.join(snapshot_dir, "horses-*.parquet"))
+    return max(snapshots, key=os.path.getmtime) if snapshots else None
+
+
+def build_snapshot(csv_path, snapshot_dir=SNAPSHOT_DIR):
+    # CSV -> typed Parquet snapshot named after the CSV's content hash, so an
+    # edited or re-downloaded file gets a fresh snapshot and old ones stay valid.
+    version = content_hash(csv_path)
+    path = snapshot_path(version, snapshot_dir)
+    if not os.path.exists(path):
+        os.makedirs(snapshot_dir, exist_ok=True)
+        tmp = path + ".part"
+        read_horse_csv(csv_path).to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+    return path, version
+
+
+def compact_horses(df):
+    # Intern every name column into one shared CategoricalDtype (int32 codes into
+    # a single vocabulary, so equal names have equal codes in every column) and
+    # make gender categorical. Earnings stay float64: float32 cannot hold
+    # multi-million purses to the cent. Before/after bytes go to attrs["memory_usage"].
+    before = int(df.memory_usage(deep=True).sum())
+    columns = [c for c in NAME_COLUMNS if c in df.columns]
+    vocabulary = pd.Index([], dtype=df["Horse Name"].dtype)
+    for col in columns:
+        vocabulary = vocabulary.append(pd.Index(df[col].dropna().unique())).unique()
+    names = pd.CategoricalDtype(vocabulary)
+
+    compact = df.copy(deep=False)
+    for col in columns:
+        compact[col] = df[col].astype(names)
+    compact["Horse Gender"] = df["Horse Gender"].astype("category")
+
+    # memory_usage(deep=True) would charge the shared vocabulary to every column
+    others = compact.drop(columns=columns)
+    after = int(others.memory_usage(deep=True).sum())
+    after += sum(compact[col].cat.codes.nbytes for col in columns)
+    after += int(vocabulary.memory_usage(deep=True))
+    compact.attrs = dict(df.attrs, memory_usage={"before": before, "after": after})
+    logger.info("Horse table memory: %.1f MB -> %.1f MB", before / 1e6, after / 1e6)
+    return compact
+
+
+def memory_report(df):
+    usage = df.attrs.get("memory_usage")
+    if usage is None:
+        return f"🧠 Horse table memory: {df.memory_usage(deep=True).sum() / 1e6:.1f} MB"
+    return f"🧠 Horse table memory: {usage['before'] / 1e6:.1f} MB → {usage['after'] / 1e6:.1f} MB"
+
+
+def read_snapshot(path, compact=True):
+    df = pd.read_parquet(path)
+    df.attrs["content_hash"] = os.path.basename(path)[len("horses-"):-len(".parquet")]
+    return compact_horses(df) if compact else df
+
+
+def load_horses(
+    csv_path=LOCAL_CSV, url=DATA_URL, offline=None, refresh=False, snapshot_dir=SNAPSHOT_DIR, compact=True, out_of_core=None
+):
+    # Shared, read-only horse table for the whole process (every Streamlit
+    # session and CLI call gets the same frame). Only re-hashes the CSV when its
+    # size or mtime changes; callers must copy before mutating. out_of_core
+    # frames are always compact and backed by memory-mapped files.
+    offline = OFFLINE if offline is None else offline
+    out_of_core = OUT_OF_CORE if out_of_core is None else out_of_core
+    if out_of_core:
+        from horse_store import build_store, latest_store, open_store  # horse_store builds on this module
+        build, latest, read = build_store, latest_store, open_store
+    else:
+        build, latest, read = build_snapshot, latest_snapshot, read_snapshot
+    with _lock:
+        if url and not offline and (refresh or not os.path.exists(csv_path)):
+            download_csv(url, csv_path)
+
+        if os.path.exists(csv_path):
+            stat = os.stat(csv_path)
+            key = (os.path.abspath(csv_path), stat.st_size, stat.st_mtime_ns, compact, out_of_core)
+            if key not in _loaded:
+                path, _ = build(csv_path, snapshot_dir)
+                _loaded[key] = read(path, compact)
+            return _loaded[key]
+
+        path = latest(snapshot_dir)
+        if path is None:
+            raise FileNotFoundError(
+                f"No horse data at {csv_path} and no {'store' if out_of_core else 'snapshot'} in {snapshot_dir}"
+                + (" (offline mode)" if offline else "")
+            )
+        if (path, compact) not in _loaded:
+            _loaded[path, compact] = read(path, compact)
+        return _loaded[path, compact]
+
+
+if __name__ == "__main__":
+    print(memory_report(load_horses()))
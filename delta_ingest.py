@@ -0,0 +1,407 @@
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_loader import SNAPSHOT_DIR, dataset_version, load_horses, parse_horse_columns, snapshot_path
+from horse_index import (
+    GRANDDAM_COLUMNS,
+    DamOffspringIndex,
+    LineageIndex,
+    NameIndex,
+    cached_index,
+    indexes_for,
+    normalize_name,
+    register_index,
+)
+from nick_stats import NickStats
+from pedigree_engine import PedigreeGraph
+from relative_recommender import PREBUILT, TOP_N, collect_relatives, iter_relatives
+from result_cache import results
+from stallion_recomender import build_recommendation
+
+# Columns that identify a horse across files, most specific first
+MATCH_COLUMNS = ["Horse Registration Number", "Horse Name"]
+LINEAGE_COLUMNS = ["Sire (Father)", "Dam (Mother)", *GRANDDAM_COLUMNS]
+
+
+def read_delta_csv(path):
+    # New foals and corrections: full rows, or just an identifier plus the
+    # columns that changed (e.g. registration number + Total Earnings (USD)).
+    return parse_horse_columns(pd.read_csv(path, low_memory=False))
+
+
+def delta_version(version, delta):
+    # Version of the updated frame: the old version chained with the delta's contents
+    if version is None:
+        return None
+    digest = hashlib.sha256(version.encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(delta, index=False).to_numpy().tobytes())
+    digest.update(repr(list(delta.columns)).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def match_rows(df, delta):
+    # Row position in df of every delta row, -1 for a new horse. The most
+    # specific identifier the delta row carries decides (a registration number
+    # that is not on file means a new horse, even if the name exists); the first
+    # matching row wins, like every name lookup in the app.
+    positions = np.full(len(delta), -1, dtype=np.int64)
+    pending = np.ones(len(delta), dtype=bool)
+    for col in MATCH_COLUMNS:
+        if col not in delta.columns or col not in df.columns:
+            continue
+        values = df[col]
+        first = (~values.duplicated() & values.notna()).to_numpy()
+        lookup = pd.Index(values[first].astype(object))
+        wanted = delta[col].astype(object)
+        has = pending & wanted.notna().to_numpy()
+        found = lookup.get_indexer(wanted[has])
+        positions[has] = np.where(found >= 0, np.flatnonzero(first)[found], -1)
+        pending &= ~has
+    return positions
+
+
+def merge_rows(df, delta, positions):
+    # df with matched rows overwritten and new horses appended. Only the values a
+    # delta row actually gives replace existing ones; blanks keep what is on file.
+    # Categorical columns keep their codes: new names are appended to the shared
+    # vocabulary, so every existing code stays valid.
+    changed, updates = positions[positions >= 0], delta[positions >= 0]
+    added = delta[positions < 0]
+
+    grown = {}
+    for col in df.columns:
+        dtype = df[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype) and col in delta.columns:
+            grown.setdefault(dtype, []).append(delta[col].dropna())
+    for dtype, values in list(grown.items()):
+        extra = pd.Index(pd.unique(pd.concat(values).astype(object)))
+        extra = extra[dtype.categories.get_indexer(extra) < 0]
+        grown[dtype] = pd.CategoricalDtype(dtype.categories.append(extra.astype(dtype.categories.dtype)))
+
+    merged = {}
+    for col in df.columns:
+        column = df[col]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            dtype = grown.get(column.dtype, column.dtype)
+            codes = column.cat.codes.to_numpy().copy()
+            new_codes = np.full(len(added), -1, dtype=codes.dtype)
+            if col in delta.columns:
+                given = updates[col].notna().to_numpy()
+                codes[changed[given]] = dtype.categories.get_indexer(updates[col][given].astype(object))
+                new_codes = dtype.categories.get_indexer(added[col].astype(object)).astype(codes.dtype)
+            merged[col] = pd.Categorical.from_codes(np.concatenate([codes, new_codes]), dtype=dtype)
+        else:
+            values = column.copy()
+            if col in delta.columns and len(changed):
+                given = updates[col].notna().to_numpy()
+                values.iloc[changed[given]] = updates[col][given].to_numpy()
+            extra = added[col] if col in delta.columns else pd.Series([None] * len(added), dtype=object)
+            merged[col] = pd.concat([values, extra.astype(column.dtype)], ignore_index=True)
+
+    merged = pd.DataFrame(merged)
+    merged.attrs = {k: v for k, v in df.attrs.items() if k not in ("memory_usage", "store")}
+    return merged
+
+
+def _producing(df, names):
+    # The mares among names whose foals have earned anything (DamOffspringIndex.producing_mares)
+    foals = df[df["Dam (Mother)"].isin(names)]
+    earnings = foals.groupby("Dam (Mother)", observed=True)["Total Earnings (USD)"].sum()
+    mares = df[df["Horse Name"].isin(names) & (df["Horse Gender"] == "Mare")]["Horse Name"]
+    return {name for name in mares if earnings.get(name, 0.0) > 0}
+
+
+def _links(graph):
+    # (vocab, sire, dam) copies of a graph's links, before apply_delta redoes them
+    return graph.vocab, graph.sire.copy(), graph.dam.copy()
+
+
+def _relinked(links, graph):
+    # True when any horse of the old graph gained, lost or changed a parent. Nodes
+    # are matched by name, since a rebuild may number them differently.
+    vocab, sire, dam = links
+    remap = graph.vocab.get_indexer(vocab)
+    kept = remap >= 0
+    if (sire[~kept] >= 0).any() or (dam[~kept] >= 0).any():
+        return True
+    remap = np.append(np.where(kept, remap, -2), -1)  # old -1 stays -1, dropped names never match
+    return not (
+        np.array_equal(remap[sire[kept]], graph.sire[remap[:-1][kept]])
+        and np.array_equal(remap[dam[kept]], graph.dam[remap[:-1][kept]])
+    )
+
+
+def _unaffected(df, new_df, changed, added, links):
+    # keep(key, value) for ResultCache.carry_over: True when a cached result for
+    # the old frame is provably still what the new frame would produce. links
+    # are the old graph's _links().
+    old_rows = df.iloc[changed]
+    new_rows = new_df.iloc[np.concatenate([changed, added])]
+    names = {n for rows in (old_rows, new_rows) for n in rows["Horse Name"] if pd.notna(n)}
+    dams = {d for rows in (old_rows, new_rows) for d in rows["Dam (Mother)"] if pd.notna(d)}
+    touched = names | dams
+    folded = {normalize_name(n) for n in names}
+    # Sires whose production record (NickStats) the update changes
+    sires = {s for rows in (old_rows, new_rows) for s in rows["Sire (Father)"] if pd.notna(s)}
+
+    # Any existing horse whose parents changed can move kinship and lineage
+    # groups anywhere downstream: nothing is carried over then. That includes a
+    # new row for a sire or dam who had none, which gives an existing node
+    # parents, so the graph's links are compared rather than the changed rows.
+    graph = cached_index(PedigreeGraph, new_df)
+    relinked = _relinked(links, graph)
+
+    # Lineage keys (sire, dam, granddams) of every touched mare: a CLI result
+    # is stale when its mare shares one of them, since her tiers may change.
+    lineage_columns = [c for c in LINEAGE_COLUMNS if c in new_df.columns]
+    touched_rows = pd.concat([old_rows, new_df[new_df["Horse Name"].isin(touched)]])
+    lineage = {
+        (col, value) for col in lineage_columns for value in touched_rows[col] if pd.notna(value)
+    }
+
+    # With no links changed, kinship between existing horses is unchanged, so an
+    # app ranking can only move when a mare starts producing earners: only she
+    # could newly outrank the weakest relative shown.
+    producing = _producing(new_df, touched) - _producing(df, touched)
+    producing = graph.vocab.get_indexer(list(producing))
+    producing = producing[producing >= 0]
+
+    def keep(key, value):
+        kind, _, folded_name = key[:3]
+        if relinked or folded_name in folded:
+            return False
+        if value is None or value.get("mare") is None:
+            return True  # unknown mare, and no new horse by that name
+        mare = value["mare"]
+        if mare["Horse Name"] in touched:
+            return False
+        if kind == "cli":
+            if any((col, mare[col]) in lineage for col in lineage_columns if pd.notna(mare[col])):
+                return False
+            if not sires.isdisjoint(value.get("candidates", ())):
+                return False
+            return not any(
+                s["Sire (Father)"] in names or s["Relative"] in touched or s["Offspring"] in names
+                for s in value["stallions"]
+            )
+        if kind == "app":
+            if key[3:] != ("kinship", graph.max_depth):
+                return False
+            relatives = value["relatives"]
+            if len(relatives) < TOP_N or any(r[0] in touched for r in relatives):
+                return False
+            # A touched producing mare at or above the weakest relative could now rank
+            floor = min(r[2] for r in relatives if r[2] is not None)
+            if not len(producing):
+                return True
+            kinship = graph.kinship_with(graph.node(mare["Horse Name"]), producing)
+            return bool((np.round(200 * kinship, 2) < floor).all())
+        return False
+
+    return keep
+
+
+def ingest(df, delta, cache=results):
+    # Applies new or changed horse rows to a loaded frame. Returns the updated
+    # frame and a report. The indexes cached for the old frame (cached_index) are
+    # brought up to date and re-filed under the new one, and cached results for
+    # mares the delta cannot affect move to the new dataset version. The old
+    # frame is left as it was, but its cached indexes now belong to the new one.
+    start = time.perf_counter()
+    keys = [c for c in MATCH_COLUMNS if c in delta.columns]
+    if not keys:
+        raise ValueError(f"Delta rows need one of {MATCH_COLUMNS} to be matched")
+    delta = delta.drop_duplicates(subset=keys, keep="last").reset_index(drop=True)
+    positions = match_rows(df, delta)
+    new_df = merge_rows(df, delta, positions)
+    changed = np.unique(positions[positions >= 0])
+    added = np.arange(len(df), len(new_df))
+    old_version = dataset_version(df)
+    new_df.attrs["content_hash"] = delta_version(old_version, delta)
+    links = _links(cached_index(PedigreeGraph, df)) if old_version is not None else None
+
+    updated = []
+    for index_cls, args, index in indexes_for(df):
+        index.apply_delta(new_df, changed, added)
+        register_index(index, new_df, *args)
+        updated.append(index_cls.__name__ + (f"{args}" if args else ""))
+
+    kept = dropped = 0
+    if old_version is not None:
+        kept, dropped = cache.carry_over(old_version, dataset_version(new_df), _unaffected(df, new_df, changed, added, links))
+    report = {
+        "version": dataset_version(new_df),
+        "updated_rows": len(changed),
+        "added_rows": len(added),
+        "ignored_columns": [c for c in delta.columns if c not in df.columns],
+        "indexes": updated,
+        "results_kept": kept,
+        "results_dropped": dropped,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+    return new_df, report
+
+
+def _same_groups(a, b):
+    return a.keys() == b.keys() and all(np.array_equal(a[k], b[k]) for k in a)
+
+
+def _same_series(a, b):
+    a, b = a.copy(), b.copy()
+    a.index, b.index = a.index.astype(object), b.index.astype(object)
+    if set(a.index) != set(b.index):
+        return False
+    b = b.reindex(a.index)
+    return np.allclose(a.to_numpy(dtype=float), b.to_numpy(dtype=float), equal_nan=True)
+
+
+def _same_table(a, b):
+    if not a.index.sort_values().equals(b.index.sort_values()) or list(a.columns) != list(b.columns):
+        return False
+    b = b.reindex(a.index)
+    numeric = a.select_dtypes("number").columns
+    return np.allclose(a[numeric].to_numpy(dtype=float), b[numeric].to_numpy(dtype=float), equal_nan=True) and all(
+        a[col].astype(object).equals(b[col].astype(object)) for col in a.columns.difference(numeric)
+    )
+
+
+def _compare(index, fresh):
+    # Names of the fields where an incrementally updated index differs from a rebuild
+    if isinstance(index, DamOffspringIndex):
+        checks = {
+            "rows": _same_groups(index.rows, fresh.rows),
+            "count": _same_series(index.count, fresh.count),
+            "total_earnings": _same_series(index.total_earnings, fresh.total_earnings),
+            "max_earnings": _same_series(index.max_earnings, fresh.max_earnings),
+            "producing_mare_rows": np.array_equal(index.producing_mare_rows, fresh.producing_mare_rows),
+        }
+    elif isinstance(index, LineageIndex):
+        checks = {
+            "by_parents": _same_groups(index.by_parents, fresh.by_parents),
+            "by_sire": _same_groups(index.by_sire, fresh.by_sire),
+            "by_dam": _same_groups(index.by_dam, fresh.by_dam),
+            "by_column": index.by_column.keys() == fresh.by_column.keys()
+            and all(_same_groups(index.by_column[c], fresh.by_column[c]) for c in index.by_column),
+            "sires": np.array_equal(index.sires, fresh.sires),
+            "dams": np.array_equal(index.dams, fresh.dams),
+        }
+    elif isinstance(index, NameIndex):
+        checks = {
+            "rows": _same_groups(index.rows, fresh.rows),
+            "keys": np.array_equal(index.keys, fresh.keys),
+            "display": np.array_equal(index.display, fresh.display),
+        }
+    elif isinstance(index, PedigreeGraph):
+        checks = {
+            "vocab": index.vocab.equals(fresh.vocab),
+            "sire": np.array_equal(index.sire, fresh.sire),
+            "dam": np.array_equal(index.dam, fresh.dam),
+            "generation": np.array_equal(index.generation, fresh.generation),
+        }
+    elif isinstance(index, NickStats):
+        checks = {
+            "sires": _same_table(index.sires, fresh.sires),
+            "nicks": _same_table(index.nicks, fresh.nicks),
+        }
+    else:
+        return []
+    return [name for name, same in checks.items() if not same]
+
+
+def _summary(kind, value):
+    # The parts of a cached result that a rebuild must reproduce
+    if value is None or value.get("mare") is None:
+        return None
+    if kind == "app":
+        return [(r[0], r[2], r[3], r[5], r[6]) for r in value["relatives"]]
+    return repr(value["stallions"])
+
+
+def check_against_rebuild(df, sample=20, cache=results):
+    # Differences between what ingest() maintained for df and a from-scratch
+    # build: every index cached for df, plus up to `sample` cached results per
+    # kind recomputed without the cache. An empty list means consistent.
+    problems = []
+    for index_cls, args, index in indexes_for(df):
+        if index_cls is PedigreeGraph:
+            fresh = PedigreeGraph(df, index.max_depth)
+        elif index_cls is NickStats:
+            fresh = NickStats(df, directory=None)  # aggregated again, not read back from disk
+        else:
+            fresh = index_cls(df, *args)
+        problems += [f"{index_cls.__name__}{args or ''}.{field}" for field in _compare(index, fresh)]
+
+    seen = {}
+    for key, value in cache.items_for(dataset_version(df)):
+        kind = key[0]
+        if kind not in ("app", "cli") or seen.get(kind, 0) >= sample or value is None or value.get("mare") is None:
+            continue
+        seen[kind] = seen.get(kind, 0) + 1
+        mare_name = value["mare"]["Horse Name"]
+        if kind == "app":
+            fresh = collect_relatives(iter_relatives(
+                df, mare_name, cached_index(DamOffspringIndex, df), cached_index(PedigreeGraph, df),
+                cached_index(NameIndex, df, "Mare"),
+            ))
+        else:
+            fresh = build_recommendation(df, mare_name, use_cache=False)
+        if _summary(kind, value) != _summary(kind, fresh):
+            problems.append(f"cached {kind} result for {mare_name}")
+    return problems
+
+
+def _plain(df):
+    # Categorical columns back to their value dtype, the way snapshots are stored
+    return df.assign(**{
+        col: df[col].astype(df[col].cat.categories.dtype)
+        for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)
+    })
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply new or changed horse rows without a full rebuild.")
+    parser.add_argument("delta", help="CSV of new foals / updated rows (registration number or name + changed columns)")
+    parser.add_argument("--check", action="store_true", help="compare against a full rebuild afterwards")
+    parser.add_argument("--sample", type=int, default=20, help="cached results per kind to re-verify with --check")
+    parser.add_argument("--snapshot", action="store_true", help=f"write the updated frame as a snapshot in {SNAPSHOT_DIR}")
+    parser.add_argument("--offline", action="store_true")
+    args = parser.parse_args(argv)
+
+    df = load_horses(offline=args.offline or None)
+    for index_cls, index_args in PREBUILT:
+        cached_index(index_cls, df, *index_args)
+
+    new_df, report = ingest(df, read_delta_csv(args.delta))
+    print(f"✅ {report['updated_rows']} horses updated, {report['added_rows']} added in {report['seconds']:.3f}s (version {report['version']})")
+    print(f"🔁 Indexes updated in place: {', '.join(report['indexes'])}")
+    print(f"🗃️ Cached results carried over: {report['results_kept']} kept, {report['results_dropped']} dropped")
+    if report["ignored_columns"]:
+        print(f"⚠️ Columns not in the registry were ignored: {', '.join(report['ignored_columns'])}")
+
+    if args.snapshot:
+        path = snapshot_path(report["version"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _plain(new_df).to_parquet(path + ".part", index=False)
+        os.replace(path + ".part", path)
+        print(f"💾 Snapshot written to {path}")
+
+    if args.check:
+        start = time.perf_counter()
+        problems = check_against_rebuild(new_df, args.sample)
+        print(f"🔍 Full rebuild check took {time.perf_counter() - start:.3f}s")
+        for problem in problems:
+            print(f"❌ Differs from a full rebuild: {problem}")
+        if problems:
+            return 1
+        print("✅ Incremental state matches a full rebuild")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
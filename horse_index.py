@@ -0,0 +1,300 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from horse_store import stored_offspring
+
+EMPTY_ROWS = np.empty(0, dtype=np.int64)
+NO_MATCH = -2  # code that equals nothing, not even a missing value (-1)
+
+
+def column_codes(column):
+    # Integer codes for a name column plus its vocabulary. Compact frames already
+    # carry shared categorical codes; plain columns are factorized here.
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(), column.cat.categories
+    codes, uniques = pd.factorize(column)
+    return codes, pd.Index(uniques)
+
+
+def code_of(vocabulary, name):
+    if pd.isna(name):
+        return NO_MATCH
+    code = vocabulary.get_indexer([name])[0]
+    return code if code >= 0 else NO_MATCH
+
+
+def _add_row(groups, key, row):
+    groups[key] = np.union1d(groups.get(key, EMPTY_ROWS), [row])
+
+
+def _remove_row(groups, key, row):
+    rows = groups.get(key, EMPTY_ROWS)
+    rows = rows[rows != row]
+    if len(rows):
+        groups[key] = rows
+    else:
+        groups.pop(key, None)
+
+
+class DamOffspringIndex:
+    # Built once per loaded frame: dam name -> offspring row positions plus
+    # offspring count, summed and max "Total Earnings (USD)".
+    def __init__(self, df):
+        self.df = df
+        stored = stored_offspring(df)  # precomputed when df is an out-of-core store
+        if stored is None:
+            groups = df.groupby("Dam (Mother)", sort=False, observed=True)
+            self.rows = groups.indices
+            stats = groups["Total Earnings (USD)"].agg(["size", "sum", "max"])
+        else:
+            self.rows, stats = stored
+        self.count = stats["size"]
+        self.total_earnings = stats["sum"]
+        self.max_earnings = stats["max"]
+        # Mares whose foals have earned anything: the only candidates worth scoring.
+        self.producing_mares = (df["Horse Gender"] == "Mare").to_numpy() & (
+            self.earnings_for(df["Horse Name"]) > 0
+        )
+        self.producing_mare_rows = np.flatnonzero(self.producing_mares)
+
+    def apply_delta(self, df, changed, added):
+        # Moves to df, the old frame with rows `changed` rewritten and `added`
+        # appended: only the dams of those rows get their groups and totals redone.
+        old_dams = self.df["Dam (Mother)"].to_numpy()[changed]
+        new_rows = np.concatenate([changed, added])
+        new_dams = df["Dam (Mother)"].to_numpy()[new_rows]
+        for row, dam in zip(changed, old_dams):
+            if pd.notna(dam):
+                _remove_row(self.rows, dam, row)
+        for row, dam in zip(new_rows, new_dams):
+            if pd.notna(dam):
+                _add_row(self.rows, dam, row)
+
+        dams = list(dict.fromkeys(d for d in np.concatenate([old_dams, new_dams]) if pd.notna(d)))
+        earnings = df["Total Earnings (USD)"].to_numpy()
+        stats = {}
+        for dam in dams:
+            if dam in self.rows:
+                values = pd.Series(earnings[self.rows[dam]])
+                stats[dam] = (len(values), values.sum(), values.max())
+        stats = pd.DataFrame(list(stats.values()), index=pd.Index(list(stats), dtype=object), columns=["size", "sum", "max"])
+        for attr, col in (("count", "size"), ("total_earnings", "sum"), ("max_earnings", "max")):
+            kept = getattr(self, attr)
+            kept = kept[~kept.index.isin(dams)]
+            kept.index = kept.index.astype(object)
+            setattr(self, attr, pd.concat([kept, stats[col]]))
+
+        self.df = df
+        refresh = np.union1d(np.flatnonzero(df["Horse Name"].isin(dams).to_numpy()), new_rows).astype(np.int64)
+        producing = np.zeros(len(df), dtype=bool)
+        producing[:len(self.producing_mares)] = self.producing_mares
+        producing[refresh] = (df["Horse Gender"].to_numpy()[refresh] == "Mare") & (
+            self.earnings_for(df["Horse Name"].iloc[refresh]) > 0
+        )
+        self.producing_mares = producing
+        self.producing_mare_rows = np.flatnonzero(producing)
+
+    def offspring_rows(self, dam_name):
+        return self.rows.get(dam_name, EMPTY_ROWS)
+
+    def offspring(self, dam_name):
+        return self.df.iloc[self.offspring_rows(dam_name)]
+
+    def offspring_of(self, dam_names):
+        rows = [self.offspring_rows(name) for name in dam_names]
+        return self.df.iloc[np.unique(np.concatenate(rows))] if rows else self.df.iloc[EMPTY_ROWS]
+
+    def earnings(self, dam_name):
+        return float(self.total_earnings.get(dam_name, 0.0))
+
+    def earnings_for(self, dam_names):
+        # Vectorized lookup for a whole column of mare names (0 when a mare has no foals).
+        names = pd.Series(dam_names)
+        if isinstance(names.dtype, pd.CategoricalDtype):
+            # Look up once per vocabulary entry, then gather by code
+            per_name = self.total_earnings.reindex(names.cat.categories).fillna(0.0).to_numpy()
+            codes = names.cat.codes.to_numpy()
+            return np.where(codes >= 0, per_name[codes], 0.0)
+        return names.map(self.total_earnings).fillna(0.0).to_numpy()
+
+
+# Granddam columns that define the later lineage tiers of the CLI recommender.
+GRANDDAM_COLUMNS = [
+    "Maternal Granddam",
+    "Paternal Granddam",
+    "Great Granddam (Dam's Dam's Dam)",
+    "Great Granddam (Sire's Dam's Dam)",
+]
+
+
+class LineageIndex:
+    # Mare row positions grouped by (sire, dam), sire, dam and each granddam
+    # column, so every lineage tier is a dict lookup instead of a frame scan.
+    # Rows with a missing key are left out, like the `==` masks they replace.
+    def __init__(self, df):
+        self.df = df
+        mare_rows = np.flatnonzero((df["Horse Gender"] == "Mare").to_numpy())
+        mares = df.iloc[mare_rows]
+
+        def group(by):
+            groups = mares.groupby(by, sort=False, observed=True)
+            return {key: mare_rows[rows] for key, rows in groups.indices.items()}
+
+        self.by_parents = group(["Sire (Father)", "Dam (Mother)"])
+        self.by_sire = group("Sire (Father)")
+        self.by_dam = group("Dam (Mother)")
+        self.by_column = {col: group(col) for col in GRANDDAM_COLUMNS if col in df.columns}
+        self.sires, self.sire_names = column_codes(df["Sire (Father)"])
+        self.dams, self.dam_names = column_codes(df["Dam (Mother)"])
+
+    def _groups_of(self, row):
+        # (groups, key) pairs a mare row belongs to, mirroring groupby's dropna
+        sire, dam = row["Sire (Father)"], row["Dam (Mother)"]
+        pairs = [(self.by_parents, (sire, dam)) if pd.notna(sire) and pd.notna(dam) else None,
+                 (self.by_sire, sire) if pd.notna(sire) else None,
+                 (self.by_dam, dam) if pd.notna(dam) else None]
+        pairs += [(groups, row[col]) if pd.notna(row[col]) else None for col, groups in self.by_column.items()]
+        return [p for p in pairs if p is not None]
+
+    def apply_delta(self, df, changed, added):
+        # Same contract as DamOffspringIndex.apply_delta.
+        for row in changed:
+            if self.df["Horse Gender"].iloc[row] == "Mare":
+                for groups, key in self._groups_of(self.df.iloc[row]):
+                    _remove_row(groups, key, row)
+        for row in np.concatenate([changed, added]):
+            if df["Horse Gender"].iloc[row] == "Mare":
+                for groups, key in self._groups_of(df.iloc[row]):
+                    _add_row(groups, key, row)
+        self.df = df
+        self.sires, self.sire_names = column_codes(df["Sire (Father)"])
+        self.dams, self.dam_names = column_codes(df["Dam (Mother)"])
+
+    def full_sisters(self, mare):
+        return self.by_parents.get((mare["Sire (Father)"], mare["Dam (Mother)"]), EMPTY_ROWS)
+
+    def half_sisters(self, mare):
+        sire, dam = mare["Sire (Father)"], mare["Dam (Mother)"]
+        paternal = self.by_sire.get(sire, EMPTY_ROWS)
+        maternal = self.by_dam.get(dam, EMPTY_ROWS)
+        # Code comparisons; a missing parent (-1) differs from every name, like NaN != name
+        return np.union1d(
+            paternal[self.dams[paternal] != code_of(self.dam_names, dam)],
+            maternal[self.sires[maternal] != code_of(self.sire_names, sire)],
+        )
+
+    def sharing(self, column, mare):
+        if column not in self.by_column or pd.isna(mare[column]):
+            return EMPTY_ROWS
+        return self.by_column[column].get(mare[column], EMPTY_ROWS)
+
+
+def normalize_name(name):
+    # Case, whitespace and punctuation folded: "Miss  O'Malley" -> "miss omalley"
+    return " ".join(re.sub(r"[^\w\s]", "", str(name).casefold()).split())
+
+
+class NameIndex:
+    # Normalized horse name -> row positions (optionally only one gender), plus a
+    # sorted key array for prefix search over typed fragments.
+    def __init__(self, df, gender=None):
+        self.df = df
+        self.gender = gender
+        mask = df["Horse Name"].notna().to_numpy()
+        if gender is not None:
+            mask = mask & (df["Horse Gender"] == gender).to_numpy()
+        rows = np.flatnonzero(mask)
+        names = df["Horse Name"].iloc[rows].astype(str)
+        keys = (
+            names.str.casefold()
+            .str.replace(r"[^\w\s]", "", regex=True)
+            .str.split()
+            .str.join(" ")
+            .to_numpy(dtype=object)
+        )
+        self.rows = {key: rows[pos] for key, pos in pd.Series(keys).groupby(keys, sort=True).indices.items()}
+        self.keys = np.array(list(self.rows), dtype=object)
+        self.names = df["Horse Name"].to_numpy()
+        self.display = self.names[[self.rows[key][0] for key in self.keys]] if len(self.keys) else self.keys
+
+    def _keys_of(self, df, rows):
+        # (row, normalized name) for the given rows that belong in this index
+        names = df["Horse Name"].to_numpy()[rows]
+        mask = pd.notna(names)
+        if self.gender is not None:
+            mask &= df["Horse Gender"].to_numpy()[rows] == self.gender
+        return [(row, normalize_name(name)) for row, name in zip(rows[mask], names[mask])]
+
+    def apply_delta(self, df, changed, added):
+        # Same contract as DamOffspringIndex.apply_delta; keys and display stay sorted.
+        touched = set()
+        for row, key in self._keys_of(self.df, changed):
+            _remove_row(self.rows, key, row)
+            touched.add(key)
+        for row, key in self._keys_of(df, np.concatenate([changed, added])):
+            _add_row(self.rows, key, row)
+            touched.add(key)
+        self.names = df["Horse Name"].to_numpy()
+        self.df = df
+        gone = [key for key in touched if key not in self.rows]
+        keep = ~np.isin(self.keys, np.array(gone, dtype=object)) if gone else np.ones(len(self.keys), dtype=bool)
+        keys, display = self.keys[keep], self.display[keep]
+        at = np.searchsorted(keys, np.array(sorted(touched), dtype=object))
+        new = [key for key, i in zip(sorted(touched), at) if key in self.rows and (i == len(keys) or keys[i] != key)]
+        at = np.searchsorted(keys, np.array(new, dtype=object))
+        keys = np.insert(keys, at, np.array(new, dtype=object))
+        display = np.insert(display, at, np.array([None] * len(new), dtype=object))
+        for key in touched:
+            if key in self.rows:
+                display[np.searchsorted(keys, key)] = self.names[self.rows[key][0]]
+        self.keys, self.display = keys, display
+
+    def rows_for(self, name):
+        return self.rows.get(normalize_name(name), EMPTY_ROWS)
+
+    def lookup(self, name):
+        rows = self.rows_for(name)
+        return rows[0] if len(rows) else None
+
+    def first_exact(self, name):
+        # First row whose raw name equals `name` exactly (like df[df["Horse Name"] == name]).
+        for row in self.rows_for(name):
+            if self.names[row] == name:
+                return row
+        return None
+
+    def search(self, fragment, limit=20):
+        prefix = normalize_name(fragment)
+        lo = np.searchsorted(self.keys, prefix, side="left")
+        hi = np.searchsorted(self.keys, prefix + "\U0010ffff", side="left")
+        return self.display[lo:min(hi, lo + limit)].tolist()
+
+
+_built = {}
+
+
+def cached_index(index_cls, df, *args):
+    # One index per frame object, so callers that pass the same loaded frame on
+    # every call (batch jobs, the loader's shared frame) only build it once.
+    index = _built.get((index_cls, id(df)) + args)
+    if index is None or index.df is not df:
+        index = register_index(index_cls(df, *args), df, *args)
+    return index
+
+
+def register_index(index, df, *args):
+    # Files an already built (or brought up to date) index under df.
+    key = (type(index), id(df)) + args
+    for stale in [k for k, v in _built.items() if v is index or k == key]:
+        del _built[stale]
+    if len(_built) >= 8:
+        _built.pop(next(iter(_built)))
+    _built[key] = index
+    return index
+
+
+def indexes_for(df):
+    # [(index class, extra args, index)] currently cached for this frame object
+    return [(key[0], key[2:], index) for key, index in list(_built.items()) if index.df is df]
@@ -0,0 +1,358 @@
+import io
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pandas.tseries.api import guess_datetime_format
+
+from data_loader import NAME_COLUMNS, SNAPSHOT_DIR, content_hash, dataset_version
+
+# ✅ Rows read per CSV chunk when building an out-of-core store; peak memory
+# while building scales with this, not with the size of the registry
+CHUNK_ROWS = int(os.environ.get("STALLION_CHUNK_ROWS", "100000"))
+
+TEXT_COLUMNS = ["Horse Registration Number", "Pedigree Link"]
+# The only columns the recommenders read; anything else in the CSV is skipped
+STORE_COLUMNS = [
+    "Horse Name",
+    "Horse Gender",
+    "Horse Registration Number",
+    "Birth Date",
+    "Pedigree Link",
+    "Total Earnings (USD)",
+    *NAME_COLUMNS[1:],
+]
+INTEGER = r"\s*[+-]?\d+\s*"
+
+logger = logging.getLogger(__name__)
+
+
+def store_path(version, snapshot_dir=SNAPSHOT_DIR):
+    return os.path.join(snapshot_dir, f"store-{version}")
+
+
+def latest_store(snapshot_dir=SNAPSHOT_DIR):
+    stores = [
+        os.path.join(snapshot_dir, d)
+        for d in (os.listdir(snapshot_dir) if os.path.isdir(snapshot_dir) else [])
+        if d.startswith("store-") and os.path.exists(os.path.join(snapshot_dir, d, "meta.json"))
+    ]
+    return max(stores, key=os.path.getmtime) if stores else None
+
+
+def _code_dtype(n):
+    # The code width pandas picks for n categories, so Categoricals wrap the
+    # stored codes without converting them
+    for dtype in (np.int8, np.int16, np.int32):
+        if n < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def _memmap(directory, name, dtype, rows):
+    if rows == 0:
+        return np.zeros(0, dtype=dtype)  # mmap cannot map an empty file
+    return np.memmap(os.path.join(directory, name), dtype=dtype, mode="r", shape=(rows,))
+
+
+class _Interner:
+    # value -> id in first-seen order, as chunk after chunk arrives
+    def __init__(self):
+        self.ids = {}
+
+    def codes(self, values):
+        codes, uniques = pd.factorize(values)
+        ids = np.fromiter((self.ids.setdefault(v, len(self.ids)) for v in uniques), dtype=np.int64, count=len(uniques))
+        return np.where(codes >= 0, ids[np.maximum(codes, 0)] if len(ids) else -1, -1)
+
+
+class _TextWriter:
+    # Appends strings as Arrow large_string buffers: UTF-8 bytes in <name>.data,
+    # end offsets in <name>.offsets (after a leading 0) and one validity byte per row
+    def __init__(self, directory, name):
+        self.files = [open(os.path.join(directory, f"{name}.{part}"), "wb") for part in ("data", "offsets", "valid")]
+        self.files[1].write(np.zeros(1, dtype=np.int64).tobytes())
+        self.size = 0
+
+    def append(self, values):
+        array = pa.array(values.astype(object), type=pa.large_string(), from_pandas=True)
+        _, offsets, data = array.buffers()
+        ends = np.frombuffer(offsets, dtype=np.int64, count=len(array) + 1)
+        if data is not None:
+            self.files[0].write(memoryview(data)[: ends[-1]])
+        self.files[1].write((ends[1:] + self.size).tobytes())
+        self.files[2].write(values.notna().to_numpy(dtype=np.uint8).tobytes())
+        self.size += int(ends[-1])
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+
+def _text_dtype():
+    # The dtype read_csv gives a text column on this pandas: str on pandas 3,
+    # object on pandas 2 (string[pyarrow_numpy] with future.infer_string)
+    return pd.read_csv(io.StringIO("text\nx\n"))["text"].dtype
+
+
+def _open_text(directory, name, rows, dtype):
+    # A text column of the given _text_dtype() over the stored buffers: Arrow
+    # backed string dtypes wrap them without copying, object columns get
+    # Python strings and NaN for missing values like read_csv gives
+    offsets = _memmap(directory, f"{name}.offsets", np.int64, rows + 1)
+    size = int(offsets[-1])
+    data = _memmap(directory, f"{name}.data", np.uint8, size) if size else np.zeros(1, dtype=np.uint8)
+    given = _memmap(directory, f"{name}.valid", np.uint8, rows)
+    valid = np.packbits(given, bitorder="little")
+    array = pa.LargeStringArray.from_buffers(rows, pa.py_buffer(offsets), pa.py_buffer(data), pa.py_buffer(valid))
+    if dtype == object:
+        values = array.to_numpy(zero_copy_only=False)
+        values[given == 0] = np.nan
+        return values
+    return pd.array(array, dtype=dtype)
+
+
+def _write_vocabulary(directory, interner, columns, rows, chunk_rows):
+    # One vocabulary for every name column in compact_horses() order (each
+    # column's names in first-seen order, column after column) written as text;
+    # returns its size and the interner id -> vocabulary code table
+    table = np.full(len(interner.ids), -1, dtype=np.int64)
+    size = 0
+    for col in columns:
+        ids = _memmap(directory, f"{col}.ids", np.int64, rows)
+        for start in range(0, rows, chunk_rows):
+            chunk = np.asarray(ids[start:start + chunk_rows])
+            unique, first = np.unique(chunk[chunk >= 0], return_index=True)
+            new = table[unique] < 0
+            unique = unique[new][np.argsort(first[new])]
+            table[unique] = np.arange(size, size + len(unique))
+            size += len(unique)
+        del ids
+    order = np.empty(size, dtype=np.int64)
+    order[table] = np.arange(size)
+    names = list(interner.ids)
+    writer = _TextWriter(directory, "names")
+    for start in range(0, size, chunk_rows):
+        writer.append(pd.Series([names[i] for i in order[start:start + chunk_rows]], dtype=object))
+    writer.close()
+    return size, table
+
+
+def _recode(directory, col, table, dtype, rows, chunk_rows):
+    # First-seen ids -> final codes, chunk by chunk
+    ids = _memmap(directory, f"{col}.ids", np.int64, rows)
+    with open(os.path.join(directory, f"{col}.codes"), "wb") as f:
+        for start in range(0, rows, chunk_rows):
+            chunk = np.asarray(ids[start:start + chunk_rows])
+            f.write(np.where(chunk >= 0, table[np.maximum(chunk, 0)] if len(table) else -1, -1).astype(dtype).tobytes())
+    del ids
+    os.remove(os.path.join(directory, f"{col}.ids"))
+
+
+def _write_offspring(directory, dams, earnings, n_names, rows, chunk_rows):
+    # Per-dam offspring groups in CSR form (dam code -> slice of row positions,
+    # ascending) plus foal count, earnings sum and max per dam. Sums and maxima
+    # are taken per block of whole dams with the same groupby as
+    # DamOffspringIndex, over the same rows in the same order, so they match it.
+    counts = np.zeros(n_names, dtype=np.int64)
+    for start in range(0, rows, chunk_rows):
+        chunk = np.asarray(dams[start:start + chunk_rows]).astype(np.int64)
+        counts += np.bincount(chunk[chunk >= 0], minlength=n_names)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    np.save(os.path.join(directory, "offspring-offsets.npy"), offsets)
+
+    members = np.lib.format.open_memmap(
+        os.path.join(directory, "offspring-rows.npy"), mode="w+", dtype=np.int64, shape=(int(offsets[-1]),)
+    )
+    cursor = offsets[:-1].copy()
+    for start in range(0, rows, chunk_rows):
+        chunk = np.asarray(dams[start:start + chunk_rows]).astype(np.int64)
+        row = np.flatnonzero(chunk >= 0)
+        order = np.argsort(chunk[row], kind="stable")
+        code, row = chunk[row][order], row[order] + start
+        rank = np.arange(len(code)) - np.searchsorted(code, code, side="left")
+        members[cursor[code] + rank] = row
+        cursor += np.bincount(code, minlength=n_names)
+    members.flush()
+
+    # Blocks of consecutive dams holding about chunk_rows foals; a dam's foals
+    # never straddle two blocks
+    stats = np.full((n_names, 2), np.nan)
+    mothers = np.flatnonzero(counts)
+    bounds = np.searchsorted(offsets[mothers + 1], np.arange(chunk_rows, offsets[-1] + chunk_rows, chunk_rows), side="left")
+    start = 0
+    for stop in np.unique(np.minimum(bounds + 1, len(mothers))):
+        block = mothers[start:stop]
+        if len(block):
+            foals = members[offsets[block[0]]:offsets[block[-1] + 1]]
+            key = np.repeat(block, counts[block])
+            agg = pd.Series(earnings[foals]).groupby(key, sort=False).agg(["sum", "max"])
+            stats[agg.index.to_numpy()] = agg.to_numpy()
+        start = stop
+    np.save(os.path.join(directory, "offspring-stats.npy"), stats)
+    del members
+
+
+def build_store(csv_path, snapshot_dir=SNAPSHOT_DIR, chunk_rows=None):
+    # CSV -> memory-mapped column store in <snapshot_dir>/store-<content hash>/,
+    # streamed chunk_rows rows at a time: name columns as codes into one shared
+    # vocabulary, numbers and dates as fixed-width arrays, text as Arrow string
+    # buffers, and the per-dam offspring groups and totals. open_store() turns
+    # it into the same frame load_horses() builds in memory.
+    chunk_rows = chunk_rows or CHUNK_ROWS
+    version = content_hash(csv_path)
+    path = store_path(version, snapshot_dir)
+    if os.path.exists(os.path.join(path, "meta.json")):
+        return path, version
+    tmp = path + ".part"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    header = list(pd.read_csv(csv_path, nrows=0).columns)
+    columns = [c for c in header if c in STORE_COLUMNS]
+    names = [c for c in NAME_COLUMNS if c in columns]
+    strings = {c: str for c in [*names, "Horse Gender", "Birth Date", *TEXT_COLUMNS] if c in columns}
+    names_seen, genders_seen = _Interner(), _Interner()  # all name columns share one
+    interners = {**dict.fromkeys(names, names_seen), "Horse Gender": genders_seen}
+    texts = {col: _TextWriter(tmp, col) for col in TEXT_COLUMNS if col in columns}
+    files = {col: open(os.path.join(tmp, f"{col}.ids"), "wb") for col in interners}
+    numbers = {col: open(os.path.join(tmp, f"{col}.values"), "wb") for col in ("Birth Date", "Total Earnings (USD)") if col in columns}
+    # Text columns read_csv would have parsed as numbers: all-integer ones
+    # (without gaps) as int64, the rest as float64
+    numeric = {col: {"numbers": True, "integers": True, "missing": False} for col in texts}
+    date_format, date_unit = None, None
+    rows = 0
+    reader = pd.read_csv(csv_path, usecols=columns, dtype=strings, chunksize=chunk_rows)
+    for chunk in reader:
+        for col, interner in interners.items():
+            files[col].write(interner.codes(chunk[col]).astype(np.int64).tobytes())
+        for col, writer in texts.items():
+            values = chunk[col]
+            given = values.dropna()
+            flags = numeric[col]
+            flags["numbers"] &= bool(pd.to_numeric(given, errors="coerce").notna().all())
+            flags["integers"] &= bool(given.str.fullmatch(INTEGER).all())
+            flags["missing"] |= bool(values.isna().any())
+            writer.append(values)
+        if "Birth Date" in numbers:
+            # Like to_datetime over the whole column: one format, guessed from
+            # the first date in the file
+            dates = chunk["Birth Date"]
+            if dates.notna().any():
+                date_format = date_format or guess_datetime_format(dates.dropna().iloc[0]) or "mixed"
+                dates = pd.to_datetime(dates, errors="coerce", format=date_format)
+            if dates.notna().any():
+                date_unit = date_unit or np.datetime_data(dates.dtype)[0]
+                values = dates.to_numpy(dtype=f"datetime64[{date_unit}]").view(np.int64)
+            else:
+                values = np.full(len(dates), np.datetime64("NaT").view(np.int64))
+            numbers["Birth Date"].write(values.tobytes())
+        if "Total Earnings (USD)" in numbers:
+            earnings = pd.to_numeric(chunk["Total Earnings (USD)"], errors="coerce").to_numpy(dtype=np.float64)
+            numbers["Total Earnings (USD)"].write(earnings.tobytes())
+        rows += len(chunk)
+    for f in [*files.values(), *numbers.values()]:
+        f.close()
+    for writer in texts.values():
+        writer.close()
+
+    n_names, table = _write_vocabulary(tmp, names_seen, names, rows, chunk_rows)
+    for col in names:
+        _recode(tmp, col, table, _code_dtype(n_names), rows, chunk_rows)
+    genders = sorted(genders_seen.ids)
+    order = np.array([genders.index(g) for g in genders_seen.ids], dtype=np.int64)
+    _recode(tmp, "Horse Gender", order, _code_dtype(len(genders)), rows, chunk_rows)
+    if "Dam (Mother)" in names and "Total Earnings (USD)" in numbers:
+        dams = _memmap(tmp, "Dam (Mother).codes", _code_dtype(n_names), rows)
+        earnings = _memmap(tmp, "Total Earnings (USD).values", np.float64, rows)
+        _write_offspring(tmp, dams, earnings, n_names, rows, chunk_rows)
+        del dams, earnings
+
+    meta = {
+        "version": version,
+        "rows": rows,
+        "columns": columns,
+        "names": n_names,
+        "genders": genders,
+        # A column without a single date parses to whatever unit pandas gives it
+        "date_unit": date_unit or np.datetime_data(pd.to_datetime(pd.Series([], dtype=str)).dtype)[0],
+        "numeric": {
+            col: ("int64" if f["integers"] and not f["missing"] else "float64") if f["numbers"] and rows else None
+            for col, f in numeric.items()
+        },
+    }
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    logger.info("Out-of-core store for %s: %d rows, %d names in %s", csv_path, rows, n_names, path)
+    return path, version
+
+
+def open_store(path, compact=True):
+    # The horse table over a build_store() directory: name and gender columns
+    # are Categoricals whose codes are the memory-mapped files, numbers and
+    # dates are memory-mapped arrays and text columns wrap the stored buffers
+    # (or hold Python strings on pandas 2, whose read_csv gives object
+    # columns), so only the pages a request touches are read in. Always
+    # compact; the argument mirrors read_snapshot().
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    rows = meta["rows"]
+    text = _text_dtype()
+    vocabulary = pd.Index(_open_text(path, "names", meta["names"], text), dtype=text)
+    names = pd.CategoricalDtype(vocabulary)
+    gender = pd.CategoricalDtype(pd.Index(meta["genders"], dtype=text))
+
+    columns = {}
+    for col in meta["columns"]:
+        if col == "Horse Gender":
+            codes = _memmap(path, f"{col}.codes", _code_dtype(len(meta["genders"])), rows)
+            columns[col] = pd.Categorical.from_codes(codes, dtype=gender, validate=False)
+        elif col in TEXT_COLUMNS:
+            values = _open_text(path, col, rows, text)
+            # read_csv parses all-numeric columns as numbers; so does this store
+            dtype = meta["numeric"].get(col)
+            columns[col] = values if dtype is None else pd.to_numeric(pd.Series(values)).to_numpy(dtype=dtype)
+        elif col == "Birth Date":
+            dates = _memmap(path, f"{col}.values", np.int64, rows)
+            columns[col] = dates.view(f"datetime64[{meta['date_unit']}]")
+        elif col == "Total Earnings (USD)":
+            columns[col] = _memmap(path, f"{col}.values", np.float64, rows)
+        else:
+            codes = _memmap(path, f"{col}.codes", _code_dtype(meta["names"]), rows)
+            columns[col] = pd.Categorical.from_codes(codes, dtype=names, validate=False)
+    df = pd.DataFrame(columns, copy=False)
+    df.attrs["content_hash"] = meta["version"]
+    df.attrs["store"] = path
+    return df
+
+
+def stored_offspring(df):
+    # DamOffspringIndex's groups and totals straight from the store df was opened
+    # from: ({dam name: row positions}, size/sum/max frame), or None when df did
+    # not come from open_store() unchanged.
+    path = df.attrs.get("store")
+    if path is None or not os.path.exists(os.path.join(path, "offspring-stats.npy")):
+        return None
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    if meta["version"] != dataset_version(df) or meta["rows"] != len(df):
+        return None
+    offsets = np.load(os.path.join(path, "offspring-offsets.npy"))
+    members = np.load(os.path.join(path, "offspring-rows.npy"), mmap_mode="r")
+    stats = np.load(os.path.join(path, "offspring-stats.npy"))
+    counts = np.diff(offsets)
+    dams = np.flatnonzero(counts)
+    # groupby(sort=False) order: by each dam's first foal
+    dams = dams[np.argsort(members[offsets[dams]], kind="stable")]
+    dtype = df["Dam (Mother)"].dtype
+    vocabulary = dtype.categories
+    rows = {vocabulary[d]: members[offsets[d]:offsets[d + 1]] for d in dams}
+    index = pd.CategoricalIndex(pd.Categorical.from_codes(dams, dtype=dtype), name="Dam (Mother)")
+    table = pd.DataFrame({"size": counts[dams], "sum": stats[dams, 0], "max": stats[dams, 1]}, index=index)
+    return rows, table
@@ -1,9 +1,41 @@
-import pandas as pd
-from stallion_recomender import recommend_stallions
+import argparse
+import cProfile
+import pstats
 
-df = pd.read_csv("Data\cleaned\Horse_Data_Cleaned.csv")
+import profiling
+from data_loader import load_horses
+from recommend_service import SERVICE_URL, ServiceClient
+from stallion_recomender import print_recommendation, recommend_stallions
 
 if __name__ == "__main__":
-    mare_name = input("Enter the name of the mare: ")
-    recommend_stallions(df, mare_name)
-    print("\n\n")
+    parser = argparse.ArgumentParser(description="Recommend stallions for one mare.")
+    parser.add_argument("--mare", help="mare name (asked interactively when omitted)")
+    parser.add_argument(
+        "--service", default=SERVICE_URL, help="URL of a running recommend_service.py to query instead of loading the data"
+    )
+    parser.add_argument("--profile", action="store_true", help="run under cProfile, bypassing the result cache")
+    parser.add_argument("--profile-output", help="also dump the raw cProfile stats to this file")
+    parser.add_argument("--trace", help="append the per-stage trace to this JSONL file")
+    args = parser.parse_args()
+
+    if args.trace:
+        profiling.TRACE_FILE = args.trace
+    mare_name = args.mare or input("Enter the name of the mare: ")
+    if args.profile:
+        # Always in-process: the point is to profile this machine's code path
+        df = load_horses()
+        profiler = cProfile.Profile()
+        profiler.runcall(recommend_stallions, df, mare_name, use_cache=False)
+        print("\n\n")
+        if args.profile_output:
+            profiler.dump_stats(args.profile_output)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+    elif args.service:
+        try:
+            print_recommendation(ServiceClient(args.service).recommend(mare_name))
+        except OSError as e:
+            print(f"❌ Recommendation service at {args.service} failed: {e}")
+        print("\n\n")
+    else:
+        recommend_stallions(load_horses(), mare_name)
+        print("\n\n")
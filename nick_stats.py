@@ -0,0 +1,193 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_loader import SNAPSHOT_DIR, dataset_version
+
+# ✅ Starters a cross (or a sire) needs before its record counts as proven
+NICK_MIN_STARTERS = int(os.environ.get("STALLION_NICK_MIN_STARTERS", "3"))
+
+BROODMARE_SIRE = "Maternal Grandsire"  # a foal's dam's sire
+STAT_COLUMNS = [
+    "starters",
+    "earners",
+    "total_earnings",
+    "median_earnings",
+    "max_earnings",
+    "earnings_per_starter",
+    "earnings_index",
+]
+DETAIL_COLUMNS = ["Horse Registration Number", "Birth Date", "Pedigree Link"]
+BASIS_ORDER = {"nick": 2, "sire": 1, "unproven": 0}
+
+logger = logging.getLogger(__name__)
+
+
+def _plain_index(index):
+    # Categorical group keys -> plain object labels, so lookups take str names
+    if isinstance(index, pd.MultiIndex):
+        return pd.MultiIndex.from_arrays(
+            [index.get_level_values(i).astype(object) for i in range(index.nlevels)], names=index.names
+        )
+    return pd.Index(index.astype(object), name=index.name)
+
+
+def _aggregate(foals, keys):
+    # One groupby pass: the production record of every key. Starters are foals
+    # with an earnings figure on file, earners those that earned anything.
+    earnings = foals["Total Earnings (USD)"]
+    table = (
+        foals.assign(earner=earnings > 0)
+        .groupby(keys, observed=True, sort=False)
+        .agg(
+            starters=("Total Earnings (USD)", "count"),
+            earners=("earner", "sum"),
+            total_earnings=("Total Earnings (USD)", "sum"),
+            median_earnings=("Total Earnings (USD)", "median"),
+            max_earnings=("Total Earnings (USD)", "max"),
+        )
+    )
+    table.index = _plain_index(table.index)
+    table["earnings_per_starter"] = table["total_earnings"] / table["starters"].where(table["starters"] > 0)
+    return table
+
+
+def _details(df, names=None):
+    # Registration, birth date and pedigree link of each stallion (first row per name)
+    stallions = df["Horse Gender"] == "Stallion"
+    if names is not None:
+        stallions &= df["Horse Name"].isin(names)
+    rows = df.loc[stallions, ["Horse Name", *DETAIL_COLUMNS]].drop_duplicates("Horse Name")
+    details = rows.set_index("Horse Name")[DETAIL_COLUMNS]
+    details.index = _plain_index(details.index)
+    return details
+
+
+class NickStats:
+    # Production records per sire and per sire x broodmare sire (the "nick":
+    # a stallion's foals out of mares by one sire), built once per frame and
+    # persisted next to its snapshot. earnings_index is earnings per starter
+    # relative to the registry-wide average, so 1.0 is an average record.
+    def __init__(self, df, directory=SNAPSHOT_DIR):
+        self.df = df
+        self.directory = directory
+        self._rows = None
+        if not self._load():
+            foals = df.loc[df["Sire (Father)"].notna(), ["Sire (Father)", BROODMARE_SIRE, "Total Earnings (USD)"]]
+            sires = _aggregate(foals, ["Sire (Father)"])
+            self.nicks = _aggregate(foals[foals[BROODMARE_SIRE].notna()], ["Sire (Father)", BROODMARE_SIRE])
+            self.sires = sires.join(_details(df, sires.index))
+            self._index()
+            self._save()
+
+    def _paths(self):
+        version = dataset_version(self.df)
+        if version is None or self.directory is None:
+            return None
+        return (
+            os.path.join(self.directory, f"sire-stats-{version}.parquet"),
+            os.path.join(self.directory, f"nick-stats-{version}.parquet"),
+        )
+
+    def _load(self):
+        paths = self._paths()
+        if paths is None or not all(os.path.exists(p) for p in paths):
+            return False
+        try:
+            self.sires = pd.read_parquet(paths[0])
+            self.nicks = pd.read_parquet(paths[1])
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable nick statistics %s: %s", paths, e)
+            return False
+        self.sires.index = _plain_index(self.sires.index)
+        self.nicks.index = _plain_index(self.nicks.index)
+        return True
+
+    def _save(self):
+        paths = self._paths()
+        if paths is None:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for table, path in zip((self.sires, self.nicks), paths):
+                table.to_parquet(path + ".part")
+                os.replace(path + ".part", path)
+        except OSError as e:
+            logger.warning("Could not persist nick statistics to %s: %s", self.directory, e)
+
+    def _index(self):
+        self._rows = None
+        starters = self.sires["starters"].sum()
+        average = self.sires["total_earnings"].sum() / starters if starters else np.nan
+        for table in (self.sires, self.nicks):
+            table["earnings_index"] = table["earnings_per_starter"] / average if average else np.nan
+
+    def apply_delta(self, df, changed, added):
+        # Same contract as DamOffspringIndex.apply_delta: only the sires of the
+        # changed and added rows are re-aggregated (and their details refreshed
+        # along with any touched stallion); the index column follows the new average.
+        old = self.df.iloc[changed]
+        new = df.iloc[np.concatenate([changed, added])]
+        sires = pd.unique(pd.concat([old["Sire (Father)"], new["Sire (Father)"]]).dropna().astype(object))
+        horses = pd.unique(pd.concat([old["Horse Name"], new["Horse Name"]]).dropna().astype(object))
+
+        columns = ["Sire (Father)", BROODMARE_SIRE, "Total Earnings (USD)"]
+        foals = df.loc[df["Sire (Father)"].isin(sires), columns]
+        sire_rows = _aggregate(foals, ["Sire (Father)"])
+        nick_rows = _aggregate(foals[foals[BROODMARE_SIRE].notna()], ["Sire (Father)", BROODMARE_SIRE])
+
+        kept = self.sires[~self.sires.index.isin(sires)].copy()
+        restamp = kept.index[kept.index.isin(horses)]
+        if len(restamp):
+            kept.loc[restamp, DETAIL_COLUMNS] = _details(df, restamp).reindex(restamp)
+        self.sires = pd.concat([kept, sire_rows.join(_details(df, sire_rows.index))])
+        self.nicks = pd.concat([self.nicks[~self.nicks.index.get_level_values(0).isin(sires)], nick_rows])
+        self.df = df
+        self._index()
+        self._save()
+
+    def _lookup(self):
+        # name -> row and (sire, broodmare sire) -> row, plus the stat columns as
+        # float arrays and the details as object arrays, each with a trailing
+        # empty row that row -1 (a key not on file) picks up
+        if self._rows is None:
+            self._rows = (
+                dict(zip(self.sires.index, range(len(self.sires)))),
+                dict(zip(self.nicks.index, range(len(self.nicks)))),
+                np.vstack([self.sires[STAT_COLUMNS].to_numpy(dtype=float), np.full(len(STAT_COLUMNS), np.nan)]),
+                np.vstack([self.nicks[STAT_COLUMNS].to_numpy(dtype=float), np.full(len(STAT_COLUMNS), np.nan)]),
+                {col: np.append(self.sires[col].to_numpy(dtype=object), None) for col in DETAIL_COLUMNS},
+            )
+        return self._rows
+
+    def rank(self, sires, broodmare_sire, limit=None):
+        # Candidate sires best first, by lookup: proven crosses with mares by
+        # broodmare_sire (NICK_MIN_STARTERS starters or more) on their own record,
+        # then sires with a proven overall record, then the rest; each tier by
+        # earnings index. Columns: STAT_COLUMNS of the record used, "basis"
+        # ("nick", "sire" or "unproven") and the stallion's DETAIL_COLUMNS.
+        sire_rows, nick_rows, sire_stats, nick_stats, details = self._lookup()
+        names = list(dict.fromkeys(s for s in sires if pd.notna(s)))
+        rows = np.array([sire_rows.get(s, -1) for s in names], dtype=np.int64)
+        stats = sire_stats[rows].reshape(len(names), len(STAT_COLUMNS))
+        starters = STAT_COLUMNS.index("starters")
+        basis = np.where(stats[:, starters] >= NICK_MIN_STARTERS, "sire", "unproven").astype(object)
+        if pd.notna(broodmare_sire):
+            nick = nick_stats[[nick_rows.get((s, broodmare_sire), -1) for s in names]].reshape(stats.shape)
+            proven = nick[:, starters] >= NICK_MIN_STARTERS
+            stats[proven] = nick[proven]
+            basis[proven] = "nick"
+
+        # Best first; NaN indexes sort last within their tier
+        tier = np.array([BASIS_ORDER[b] for b in basis])
+        score = np.nan_to_num(stats[:, STAT_COLUMNS.index("earnings_index")], nan=-np.inf)
+        total = np.nan_to_num(stats[:, STAT_COLUMNS.index("total_earnings")], nan=-np.inf)
+        order = np.lexsort((-total, -score, -tier))
+        order = order[:limit]
+        ranked = dict(zip(STAT_COLUMNS, stats[order].T))
+        ranked["basis"] = basis[order]
+        ranked.update((col, values[rows[order]]) for col, values in details.items())
+        index = pd.Index([names[i] for i in order], dtype=object, name="Sire (Father)")
+        return pd.DataFrame(ranked, index=index, columns=[*STAT_COLUMNS, "basis", *DETAIL_COLUMNS])
@@ -0,0 +1,477 @@
+import heapq
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from profiling import span
+
+# Positional weight of every flattened pedigree slot (generation 1 .. 4).
+PEDIGREE_WEIGHTS = {
+    "Sire (Father)": 0.50, "Dam (Mother)": 0.50,
+    "Paternal Grandsire": 0.25, "Paternal Granddam": 0.25,
+    "Maternal Grandsire": 0.25, "Maternal Granddam": 0.25,
+    "Great Grandsire (Sire's Sire)": 0.125, "Great Granddam (Sire's Sire's Dam)": 0.125,
+    "Great Grandsire (Sire's Dam's Sire)": 0.125, "Great Granddam (Sire's Dam's Dam)": 0.125,
+    "Great Grandsire (Dam's Sire)": 0.125, "Great Granddam (Dam's Sire's Dam)": 0.125,
+    "Great Grandsire (Dam's Dam's Sire)": 0.125, "Great Granddam (Dam's Dam's Dam)": 0.125,
+    "Great-Great Grandsire (Sire's Sire's Sire)": 0.0625, "Great-Great Granddam (Sire's Sire's Dam)": 0.0625,
+    "Great-Great Grandsire (Sire's Sire's Dam's Sire)": 0.0625, "Great-Great Granddam (Sire's Sire's Dam's Dam)": 0.0625,
+    "Great-Great Grandsire (Sire's Dam's Sire)": 0.0625, "Great-Great Granddam (Sire's Dam's Dam)": 0.0625,
+    "Great-Great Grandsire (Sire's Dam's Dam's Sire)": 0.0625, "Great-Great Granddam (Sire's Dam's Dam's Dam)": 0.0625,
+    "Great-Great Grandsire (Dam's Sire's Sire)": 0.0625, "Great-Great Granddam (Dam's Sire's Dam)": 0.0625,
+    "Great-Great Grandsire (Dam's Sire's Dam's Sire)": 0.0625, "Great-Great Granddam (Dam's Sire's Dam's Dam)": 0.0625,
+    "Great-Great Grandsire (Dam's Dam's Sire)": 0.0625, "Great-Great Granddam (Dam's Dam's Dam)": 0.0625,
+    "Great-Great Grandsire (Dam's Dam's Dam's Sire)": 0.0625, "Great-Great Granddam (Dam's Dam's Dam's Dam)": 0.0625,
+}
+PEDIGREE_COLUMNS = list(PEDIGREE_WEIGHTS)
+
+# ✅ Set STALLION_KINSHIP_DEPTH to bound kinship paths (generations up from both horses); unset = whole graph
+KINSHIP_DEPTH = int(os.environ["STALLION_KINSHIP_DEPTH"]) if os.environ.get("STALLION_KINSHIP_DEPTH") else None
+# ✅ Set STALLION_KINSHIP_TABLE_MB to size one kinship working table (larger batches take several passes)
+KINSHIP_TABLE_MB = float(os.environ.get("STALLION_KINSHIP_TABLE_MB", "64"))
+
+logger = logging.getLogger(__name__)
+
+
+# Parents of the sire and dam for when they have no row of their own. Deeper
+# slots are left out: their names do not say unambiguously whose parents they hold.
+GRANDPARENT_COLUMNS = {
+    "Sire (Father)": ("Paternal Grandsire", "Paternal Granddam"),
+    "Dam (Mother)": ("Maternal Grandsire", "Maternal Granddam"),
+}
+GRAPH_COLUMNS = ["Horse Name", *GRANDPARENT_COLUMNS, *(c for pair in GRANDPARENT_COLUMNS.values() for c in pair)]
+
+
+class PedigreeGraph:
+    # Sire/dam links between horses plus Wright/Malécot kinship on top. A node
+    # is a horse name (equal names are the same horse, as everywhere else in
+    # the app).
+    #   sire[v], dam[v]  parent node ids, -1 when unknown
+    #   generation[v]    0 for founders, else 1 + the younger parent's generation,
+    #                    so parents always sort before their foals
+    #   row_nodes[r]     node of df row r
+    # max_depth bounds the path length through a common ancestor (generations up
+    # from one horse plus generations up from the other); None traces everything.
+    def __init__(self, df, max_depth=KINSHIP_DEPTH):
+        self.max_depth = max_depth
+        self._build(df)
+
+    def _build(self, df):
+        self.df = df
+        frame = df.reindex(columns=GRAPH_COLUMNS)
+        dtypes = set(frame.dtypes)
+        if len(dtypes) == 1 and isinstance(frame.dtypes.iloc[0], pd.CategoricalDtype):
+            self.vocab = frame.dtypes.iloc[0].categories
+            codes = {col: frame[col].cat.codes.to_numpy().astype(np.int64) for col in GRAPH_COLUMNS}
+        else:
+            values = frame.to_numpy(dtype=object)
+            flat, vocab = pd.factorize(values.ravel())
+            self.vocab = pd.Index(vocab)
+            flat = flat.reshape(values.shape)
+            codes = {col: flat[:, j] for j, col in enumerate(GRAPH_COLUMNS)}
+
+        n = len(self.vocab)
+        self.row_nodes = codes["Horse Name"]
+        self.sire = np.full(n, -1, dtype=np.int64)
+        self.dam = np.full(n, -1, dtype=np.int64)
+        # The horse's own row wins, then the grandparent slots of its foals' rows
+        self._link(codes["Horse Name"], codes["Sire (Father)"], codes["Dam (Mother)"])
+        for parent, (grandsire, granddam) in GRANDPARENT_COLUMNS.items():
+            self._link(codes[parent], codes[grandsire], codes[granddam])
+        self.generation = self._generations()
+        # The same as a narrow int where it fits, which numpy sorts by radix
+        self._sort_generation = self.generation.astype(np.int16 if self.generation.max(initial=0) < 2**15 else np.int64)
+
+        self._sires = self.sire.tolist()
+        self._dams = self.dam.tolist()
+        # Every node by (generation, id): parents first, and the younger horse
+        # of any pair (the one the kinship recursion expands) last
+        self._order = np.argsort(self.generation, kind="stable")
+        self._rank = np.empty(n, dtype=np.int64)
+        self._rank[self._order] = np.arange(n)
+        # Foals of every node in CSR form (children[child_offsets[v]:child_offsets[v + 1]])
+        parents = np.concatenate([self.sire, self.dam])
+        foals = np.tile(np.arange(n, dtype=np.int64), 2)[parents >= 0]
+        parents = parents[parents >= 0]
+        self.children = foals[np.argsort(parents, kind="stable")]
+        self.child_offsets = np.concatenate([[0], np.cumsum(np.bincount(parents, minlength=n))])
+        # Inbreeding per remaining path budget, filled in as queries need it;
+        # _known[v] is the highest budget cached for v (-1: none)
+        self._inbreeding = np.zeros((self._budget() + 1, n))
+        self._known = np.full(n, -1, dtype=np.int64)
+
+    def apply_delta(self, df, changed, added):
+        # Rebuilt from scratch: a horse's parents come from the first row naming
+        # them (its own, then its foals' grandparent slots), so any changed row
+        # can move links, and the inbreeding cache goes with them.
+        self._build(df)
+
+    def _link(self, children, sires, dams):
+        # First recorded parent per child wins; self-parenting is dropped.
+        for parent, values in ((self.sire, sires), (self.dam, dams)):
+            known = (children >= 0) & (values >= 0) & (children != values)
+            child, first = np.unique(children[known], return_index=True)
+            value = values[known][first]
+            missing = parent[child] < 0
+            parent[child[missing]] = value[missing]
+
+    def _generations(self):
+        n = len(self.sire)
+        generation = np.zeros(n, dtype=np.int64)
+        resolved = (self.sire < 0) & (self.dam < 0)
+        pending = np.flatnonzero(~resolved)
+        while len(pending):
+            sire, dam = self.sire[pending], self.dam[pending]
+            ready = ((sire < 0) | resolved[sire]) & ((dam < 0) | resolved[dam])
+            if not ready.any():
+                self._break_cycles(pending)
+                continue
+            done = pending[ready]
+            generation[done] = 1 + np.maximum(
+                np.where(sire[ready] >= 0, generation[sire[ready]], -1),
+                np.where(dam[ready] >= 0, generation[dam[ready]], -1),
+            )
+            resolved[done] = True
+            pending = pending[~ready]
+        return generation
+
+    def _break_cycles(self, pending):
+        # A horse listed as its own ancestor (usually two horses sharing a name).
+        # Peel off blocked horses that no other blocked horse descends from, then
+        # cut the parent links among what is left.
+        on_cycle = np.zeros(len(self.sire), dtype=bool)
+        on_cycle[pending] = True
+        while True:
+            members = np.flatnonzero(on_cycle)
+            needed = np.zeros_like(on_cycle)
+            for parent in (self.sire, self.dam):
+                p = parent[members]
+                needed[p[p >= 0]] = True
+            if (on_cycle & needed).sum() == len(members):
+                break
+            on_cycle &= needed
+        members = np.flatnonzero(on_cycle)
+        for parent in (self.sire, self.dam):
+            p = parent[members]
+            cut = members[(p >= 0) & on_cycle[np.maximum(p, 0)]]
+            parent[cut] = -1
+        logger.warning("Pedigree cycle: cut parent links of %d horses", len(members))
+
+    def node(self, name):
+        return int(self.vocab.get_indexer([name])[0])
+
+    def _budget(self):
+        # Path budget of a whole query: max_depth, or 0 when unbounded (where
+        # budgets never run down)
+        return 0 if self.max_depth is None else self.max_depth
+
+    def _columns(self, rows, slabs):
+        # Horses per kinship pass, so one working table stays near KINSHIP_TABLE_MB
+        return max(1, int(KINSHIP_TABLE_MB * 1e6 / 8) // (slabs * (rows + 1)))
+
+    def _in_order(self, nodes):
+        # The distinct nodes in (generation, id) order
+        ranks = np.sort(self._rank[np.asarray(nodes, dtype=np.int64)])
+        return self._order[ranks[np.diff(ranks, prepend=-1) != 0]]
+
+    def _positions(self, order):
+        # node -> position in order, len(order) for nodes not in it (and for -1)
+        positions = np.full(len(self.sire) + 1, len(order), dtype=np.int64)
+        positions[order] = np.arange(len(order))
+        return positions
+
+    def _levels(self, order):
+        # (lo, hi) bounds of each generation in an _in_order() node array
+        bounds = np.flatnonzero(np.diff(self.generation[order], prepend=-1, append=-1))
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def _reach(self, nodes, budgets, up):
+        # Budget left on reaching every node from the starting nodes, going up to
+        # parents or down to foals (-1 if not reached); each generation crossed
+        # costs 1 under max_depth
+        best = np.full(len(self.sire), -1, dtype=np.int64)
+        mark = np.empty(len(self.sire), dtype=np.int64)
+        np.maximum.at(best, nodes, budgets)
+        frontier = np.unique(nodes)
+        step = 0 if self.max_depth is None else 1
+        while len(frontier):
+            frontier = frontier[best[frontier] >= step]
+            if up:
+                linked = np.concatenate([self.sire[frontier], self.dam[frontier]])
+                left = np.tile(best[frontier] - step, 2)[linked >= 0]
+                linked = linked[linked >= 0]
+            else:
+                starts = self.child_offsets[frontier]
+                counts = self.child_offsets[frontier + 1] - starts
+                linked = self.children[np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())]
+                left = np.repeat(best[frontier] - step, counts)
+            before = best[linked]
+            np.maximum.at(best, linked, left)
+            linked = linked[best[linked] > before]
+            # one of each: whichever occurrence's mark sticks
+            mark[linked] = np.arange(len(linked))
+            frontier = linked[mark[linked] == np.arange(len(linked))]
+        return best
+
+    def _ancestors(self, nodes, budgets):
+        # The nodes and every ancestor within their budgets, in _in_order()
+        # order, with the budget left on reaching each
+        best = self._reach(nodes, budgets, up=True)
+        order = self._in_order(np.flatnonzero(best >= 0))
+        return order, best[order]
+
+    def _descendants(self, nodes, budgets):
+        # The nodes and every descendant within their budgets
+        return np.flatnonzero(self._reach(nodes, budgets, up=False) >= 0)
+
+    def _mendelian(self, nodes, budget):
+        # delta[r, i]: the part of f(v, v) (v = nodes[i]) with r generations of
+        # budget left that v's parents do not account for,
+        # 1/2 - (f(sire, sire) + f(dam, dam)) / 4 (their self-kinship two
+        # generations further up under max_depth)
+        shift = 0 if self.max_depth is None else 2
+        count = max(budget + 1 - shift, 0)
+        delta = np.full((budget + 1, len(nodes)), 0.5)
+        for parent in (self.sire[nodes], self.dam[nodes]):
+            known = np.flatnonzero(parent >= 0)
+            selfs = np.full((count, len(known)), 0.5)
+            selfs[shift:] += 0.5 * self._inbreeding[: max(count - shift, 0), parent[known]]
+            delta[shift:, known] -= 0.25 * selfs
+        return delta
+
+    def _kinship_from(self, sources, order, budget):
+        # table[r, j, i] = f(sources[i], order[j]) with r generations of path
+        # budget left, by the indirect method (A = T D T'): path weights from each
+        # source up to its ancestors, times each ancestor's Mendelian term, then
+        # passed down to the foals, f(i, u) += (f(i, sire) + f(i, dam)) / 2. order
+        # (in _in_order() order) must hold the sources' ancestors within budget
+        # and every horse on the way down to the ones asked about; row
+        # len(order) is 0 (unknown horse). Inbreeding is read from the cache, so
+        # _prepare() the sources first.
+        step = 0 if self.max_depth is None else 1
+        slabs, size = budget + 1, len(order)
+        positions = self._positions(order)
+        sire, dam = positions[self.sire[order]], positions[self.dam[order]]
+        levels = self._levels(order)
+        # paths[l, j, i]: sum of 2^-l over the l-generation paths from sources[i]
+        # up to order[j] (all lengths in one slab when unbounded), youngest first
+        paths = np.zeros((slabs, size + 1, len(sources)))
+        paths[0, positions[sources], np.arange(len(sources))] = 1
+        parents = np.concatenate([sire, dam])
+        foals = np.tile(np.arange(size), 2)[parents < size]
+        parents = parents[parents < size]
+        by_parent = np.argsort(parents, kind="stable")
+        parents, foals = parents[by_parent], foals[by_parent]
+        for lo, hi in reversed(levels):
+            first, last = np.searchsorted(parents, [lo, hi])
+            if first == last:
+                continue
+            group = parents[first:last]
+            starts = np.flatnonzero(np.diff(group, prepend=-1))
+            pulled = np.add.reduceat(paths[: slabs - step, foals[first:last]], starts, axis=1)
+            paths[step:, group[starts]] += 0.5 * pulled
+        delta = np.zeros((slabs, size + 1))
+        delta[:, :size] = self._mendelian(order, budget)
+        table = np.zeros_like(paths)
+        for length in range(slabs):
+            table[length:] += paths[length] * delta[: slabs - length, :, None]
+        for lo, hi in levels:
+            s, d = sire[lo:hi], dam[lo:hi]
+            table[step:, lo:hi] += 0.5 * (table[: slabs - step, s] + table[: slabs - step, d])
+        return table
+
+    def _paths_up(self, sources, budget):
+        # Path weights from each source up to its ancestors within budget, as
+        # sparse entries (column, node, weights): weights[e, l] is the sum of 2^-l
+        # over the l-generation paths from sources[column] to node (all lengths
+        # in one slab when unbounded). A generation at a time, youngest first, so
+        # a node's entries are complete before they pass on to its parents.
+        step = 0 if self.max_depth is None else 1
+        n = len(self.sire)
+        pending = {}  # generation -> [(columns, nodes, weights)] still to merge
+
+        def queue(columns, nodes, weights):
+            by_generation = np.argsort(self._sort_generation[nodes], kind="stable")
+            columns, nodes, weights = columns[by_generation], nodes[by_generation], weights[by_generation]
+            generations = self.generation[nodes]
+            bounds = np.flatnonzero(np.diff(generations, prepend=-1, append=-1))
+            for lo, hi in zip(bounds[:-1], bounds[1:]):
+                pending.setdefault(generations[lo], []).append((columns[lo:hi], nodes[lo:hi], weights[lo:hi]))
+
+        weights = np.zeros((len(sources), budget + 1))
+        weights[:, 0] = 1
+        queue(np.arange(len(sources)), np.asarray(sources, dtype=np.int64), weights)
+        found = [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty((0, budget + 1)))]
+        while pending:
+            columns, nodes, weights = (np.concatenate(part) for part in zip(*pending.pop(max(pending))))
+            keys, inverse = np.unique(columns * n + nodes, return_inverse=True)
+            weights = np.stack([np.bincount(inverse, weights=w, minlength=len(keys)) for w in weights.T], axis=1)
+            columns, nodes = keys // n, keys % n
+            found.append((columns, nodes, weights))
+            # one generation up, dropping the paths that have used up the budget
+            passed = np.zeros_like(weights)
+            passed[:, step:] = 0.5 * weights[:, : budget + 1 - step]
+            alive = np.flatnonzero(passed.any(axis=1))
+            linked = np.concatenate([self.sire[nodes[alive]], self.dam[nodes[alive]]])
+            keep = np.tile(alive, 2)[linked >= 0]
+            if len(keep):
+                queue(columns[keep], linked[linked >= 0], passed[keep])
+        return (np.concatenate(part) for part in zip(*found))
+
+    def _pair_kinship(self, a, b, budget):
+        # f(a[i], b[i]) for every budget 0..budget, shape (budget + 1, len(a)),
+        # over the pairs' common ancestors only: the sum over each ancestor of
+        # the path weights from both horses times its Mendelian term (the
+        # indirect method, A = T D T')
+        count = len(a)
+        columns, nodes, weights = self._paths_up(np.concatenate([a, b]), budget)
+        side = columns >= count
+        keys = (columns % count) * len(self.sire) + nodes
+        _, left, right = np.intersect1d(keys[~side], keys[side], assume_unique=True, return_indices=True)
+        pair, common = columns[~side][left], nodes[~side][left]
+        up, down = weights[~side][left], weights[side][right]
+        delta = self._mendelian(common, budget).T
+        weighed = np.zeros_like(up)
+        for length in range(budget + 1):
+            weighed[:, length:] += up[:, [length]] * delta[:, : budget + 1 - length]
+        terms = np.zeros_like(up)
+        for length in range(budget + 1):
+            terms[:, length:] += weighed[:, : budget + 1 - length] * down[:, [length]]
+        return np.stack([np.bincount(pair, weights=t, minlength=count) for t in terms.T])
+
+    def _kinship_between(self, a, b, budget):
+        # f(a[i], b[i]) for every budget 0..budget, shape (budget + 1, len(a)),
+        # in batches of pairs sized so their path entries stay near KINSHIP_TABLE_MB
+        a, b = np.asarray(a, dtype=np.int64), np.asarray(b, dtype=np.int64)
+        kinship = np.zeros((budget + 1, len(a)))
+        pairs = np.flatnonzero((a >= 0) & (b >= 0))
+        if not len(pairs):
+            return kinship
+        a, b = a[pairs], b[pairs]
+        order, _ = self._ancestors(np.concatenate([a, b]), np.full(2 * len(a), budget))
+        width = self._columns(2 * len(order), budget + 1)
+        for lo in range(0, len(a), width):
+            kinship[:, pairs[lo : lo + width]] = self._pair_kinship(a[lo : lo + width], b[lo : lo + width], budget)
+        return kinship
+
+    def _ensure_inbreeding(self, nodes, budgets):
+        # Caches F (for every budget up to the one asked) of the nodes and of the
+        # ancestors it rests on, a generation at a time, oldest first: a horse's
+        # F only reads the F of horses older than its parents
+        nodes, budgets = self._ancestors(nodes, budgets)
+        todo = budgets > self._known[nodes]
+        nodes, budgets = nodes[todo], budgets[todo]
+        by_budget = np.lexsort((budgets, self.generation[nodes]))
+        nodes, budgets = nodes[by_budget], budgets[by_budget]
+        keys = self.generation[nodes] * (self._budget() + 1) + budgets
+        bounds = np.flatnonzero(np.diff(keys, prepend=-1, append=-1))
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            group, budget = nodes[lo:hi], budgets[lo]
+            self._inbreeding[: budget + 1, group] = self._kinship_between(self.sire[group], self.dam[group], budget)
+            self._known[group] = budget
+
+    def _prepare(self, nodes):
+        # Caches the inbreeding that kinship from these nodes reads: their
+        # parents' and on up (under max_depth, 4 generations less of budget at
+        # the parents and one less per generation beyond)
+        nodes = np.asarray(nodes, dtype=np.int64)
+        parents = np.concatenate([self.sire[nodes[nodes >= 0]], self.dam[nodes[nodes >= 0]]])
+        parents = parents[parents >= 0]
+        budget = 0 if self.max_depth is None else self.max_depth - 4
+        if len(parents) and budget >= 0:
+            self._ensure_inbreeding(parents, np.full(len(parents), budget))
+
+    def kinship_pairs(self, pairs):
+        # f(a, b) for each (a, b) node pair
+        a, b = (np.array([pair[i] for pair in pairs], dtype=np.int64) for i in (0, 1))
+        self._prepare(np.concatenate([a, b]))
+        return self._kinship_between(a, b, self._budget())[-1]
+
+    def kinship(self, a, b):
+        return float(self.kinship_pairs([(int(a), int(b))])[0])
+
+    def inbreeding(self, v):
+        if v < 0:
+            return 0.0
+        self._ensure_inbreeding(np.array([v]), np.array([self._budget()]))
+        return float(self._inbreeding[-1, v])
+
+    def relationship(self, a, b):
+        # Wright's coefficient of relationship
+        f = self.kinship(a, b)
+        if f == 0:
+            return 0.0
+        return 2 * f / np.sqrt((1 + self.inbreeding(a)) * (1 + self.inbreeding(b)))
+
+    def ancestry(self, v):
+        # {v and each of its ancestors: fewest generations back from v}
+        back = {v: 0}
+        frontier = [v]
+        generations = 0
+        while frontier:
+            generations += 1
+            parents = [p for u in frontier for p in (self._sires[u], self._dams[u]) if p >= 0 and p not in back]
+            frontier = list(dict.fromkeys(parents))
+            back.update(dict.fromkeys(frontier, generations))
+        return back
+
+    def common_ancestors(self, a, b):
+        # Nearest shared ancestors (no other shared ancestor between them and the
+        # pair) as (node, generations back from a, from b), closest first.
+        back_a, back_b = self.ancestry(a), self.ancestry(b)
+        shared = back_a.keys() & back_b.keys()
+        if self.max_depth is not None:
+            shared = {c for c in shared if back_a[c] + back_b[c] <= self.max_depth}
+        behind = {p for c in shared for p in (self._sires[c], self._dams[c])}
+        nearest = [(c, back_a[c], back_b[c]) for c in shared if c not in behind]
+        return sorted(nearest, key=lambda x: (x[1] + x[2], x[0]))
+
+    def kinship_with(self, v, nodes=None):
+        return self.kinship_with_many([v], nodes)[0]
+
+    def kinship_with_many(self, vs, nodes=None):
+        # Batch: f(v, u) for every v in vs and every node u (or just nodes), row i
+        # for vs[i]. Only her ancestors' descendants (down as far as the budget
+        # reaches under max_depth) can be related to her, so one _kinship_from
+        # pass over them scores everyone; mares go through in batches that keep
+        # the working table within KINSHIP_TABLE_MB.
+        with span("pedigree_scoring") as counts:
+            vs = np.asarray(vs, dtype=np.int64)
+            budget = self._budget()
+            self._prepare(vs)
+            result = np.zeros((len(vs), len(self.sire) if nodes is None else len(nodes)))
+            counts.update(mares=len(vs), ancestors=0, relatives_swept=0,
+                          candidates_scored=len(self.sire) if nodes is None else len(nodes))
+            width = self._columns(len(self.sire), budget + 1)
+            for lo in range(0, len(vs), width):
+                rows = lo + np.flatnonzero(vs[lo : lo + width] >= 0)
+                if not len(rows):
+                    continue
+                above, left = self._ancestors(vs[rows], np.full(len(rows), budget))
+                swept = self._in_order(self._descendants(above, left))
+                kinship = self._kinship_from(vs[rows], swept, budget)[-1]
+                if nodes is None:
+                    result[np.ix_(rows, swept)] = kinship[: len(swept)].T
+                else:
+                    result[rows] = kinship[self._positions(swept)[nodes]].T
+                counts["ancestors"] += len(above)
+                counts["relatives_swept"] += len(swept)
+            return result
+
+    def related(self, horse_row, rows):
+        # Additive relationship (2 x kinship) of horse_row with the horses at the
+        # given row positions, in %: the expected share of genes identical by descent.
+        return self.related_many([horse_row["Horse Name"]], rows)[0]
+
+    def related_many(self, names, rows):
+        # related() for several horses (by name) in one scoring pass, row i for names[i]
+        kinship = self.kinship_with_many([self.node(name) for name in names], self.row_nodes[rows])
+        return np.round(200 * kinship, 2)
+
+
+def top_k(rows, percentages, k):
+    # Bounded heap selection of the k best (row, %) pairs; ties keep row order.
+    best = heapq.nsmallest(k, zip(-percentages, rows))
+    return [(row, -neg) for neg, row in best]
@@ -0,0 +1,105 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+# ✅ Set STALLION_TRACE_FILE to append one JSON line per traced request
+TRACE_FILE = os.environ.get("STALLION_TRACE_FILE") or None
+
+logger = logging.getLogger("stallion.trace")
+_current = contextvars.ContextVar("stallion_trace", default=None)
+_write_lock = threading.Lock()
+
+
+class Trace:
+    # One request (e.g. one mare recommendation): named spans in the order they
+    # finished, each with its duration and whatever counts the code attached.
+    def __init__(self, request, **fields):
+        self.request = request
+        self.fields = fields
+        self.started = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+        self.spans = []
+        self.total_ms = None
+
+    def record(self, name, seconds, **counts):
+        self.spans.append({"name": name, "ms": round(seconds * 1000, 3), **counts})
+
+    def to_dict(self):
+        return {
+            "request": self.request,
+            **self.fields,
+            "started": self.started,
+            "total_ms": self.total_ms,
+            "spans": self.spans,
+        }
+
+
+def current_trace():
+    return _current.get()
+
+
+def emit(trace, sink=None):
+    record = trace.to_dict()
+    logger.debug("%s", record)
+    sink = sink or TRACE_FILE
+    if sink:
+        line = json.dumps(record, default=str, ensure_ascii=False)
+        with _write_lock, open(sink, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+@contextlib.contextmanager
+def trace_request(request, sink=None, emit_on_exit=True, **fields):
+    # Opens a trace for the enclosed work and emits it on exit. Inside an
+    # already traced request it just joins the outer trace.
+    outer = _current.get()
+    if outer is not None:
+        yield outer
+        return
+    trace = Trace(request, **fields)
+    token = _current.set(trace)
+    start = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        trace.total_ms = round((time.perf_counter() - start) * 1000, 3)
+        _current.reset(token)
+        if emit_on_exit:
+            emit(trace, sink)
+
+
+@contextlib.contextmanager
+def span(name, **counts):
+    # Times the enclosed block into the active trace; the yielded dict collects
+    # counts (rows scanned, candidates scored, ...). A no-op outside a trace.
+    trace = _current.get()
+    if trace is None:
+        yield counts
+        return
+    start = time.perf_counter()
+    try:
+        yield counts
+    finally:
+        trace.record(name, time.perf_counter() - start, **counts)
+
+
+class Laps:
+    # Consecutive stages of one function: each lap() records the time since the
+    # previous lap (or creation) as a span. A no-op outside a trace.
+    def __init__(self):
+        self.last = time.perf_counter()
+
+    def lap(self, name, **counts):
+        now = time.perf_counter()
+        trace = _current.get()
+        if trace is not None:
+            trace.record(name, now - self.last, **counts)
+        self.last = now
+
+    def restart(self):
+        # Start the next lap now, e.g. after a call that recorded its own span.
+        self.last = time.perf_counter()
@@ -0,0 +1,387 @@
+import argparse
+import json
+import logging
+import math
+import os
+import queue
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import Future
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from data_loader import dataset_version, load_horses
+from horse_index import DamOffspringIndex, NameIndex, cached_index
+from nick_stats import NickStats
+from pedigree_engine import PedigreeGraph
+from profiling import trace_request
+from relative_recommender import PREBUILT, TOP_N, collect_relatives, iter_relatives, top_stallions_for
+from result_cache import result_key, results
+from stallion_recomender import build_recommendation
+
+# ✅ Set STALLION_SERVICE_URL (e.g. http://127.0.0.1:8765) to have main.py and
+# the web app query a running service instead of loading the registry themselves
+SERVICE_URL = os.environ.get("STALLION_SERVICE_URL") or None
+HOST = "127.0.0.1"  # local only: the service never needs the network
+PORT = int(os.environ.get("STALLION_SERVICE_PORT", "8765"))
+# Relatives requests queued while a kinship pass runs (plus any arriving within
+# the window after it) share the next pass; 0 adds no latency to a lone request
+BATCH_WINDOW_MS = float(os.environ.get("STALLION_SERVICE_BATCH_WINDOW_MS", "0"))
+BATCH_SIZE = int(os.environ.get("STALLION_SERVICE_BATCH_SIZE", "8"))
+
+logger = logging.getLogger(__name__)
+
+
+def _jsonable(value):
+    # Results as plain JSON: rows become dicts, numpy scalars Python numbers,
+    # dates ISO strings and missing values (NaN, NaT, None) null.
+    if isinstance(value, pd.Series):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_jsonable(v) for v in value]
+    if value is None or pd.isna(value):
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+class Metrics:
+    # Request counts, errors and latency per endpoint, plus how the relatives
+    # batcher grouped its requests; read through GET /metrics.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.endpoints = {}
+        self.in_flight = 0
+        self.batches = {"batches": 0, "requests": 0, "mares": 0, "largest": 0}
+
+    def begin(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def end(self, endpoint, seconds, error):
+        with self.lock:
+            self.in_flight -= 1
+            stats = self.endpoints.setdefault(endpoint, {"requests": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stats["requests"] += 1
+            stats["errors"] += error
+            stats["total_ms"] += seconds * 1000
+            stats["max_ms"] = max(stats["max_ms"], seconds * 1000)
+
+    def batch(self, requests, mares):
+        with self.lock:
+            self.batches["batches"] += 1
+            self.batches["requests"] += requests
+            self.batches["mares"] += mares
+            self.batches["largest"] = max(self.batches["largest"], requests)
+
+    def to_dict(self):
+        with self.lock:
+            endpoints = {
+                name: {**stats, "mean_ms": round(stats["total_ms"] / stats["requests"], 3), "max_ms": round(stats["max_ms"], 3)}
+                for name, stats in self.endpoints.items()
+            }
+            for stats in endpoints.values():
+                del stats["total_ms"]
+            return {
+                "uptime_s": round(time.time() - self.started, 1),
+                "in_flight": self.in_flight,
+                "endpoints": endpoints,
+                "relatives_batches": dict(self.batches),
+                "result_cache": results.stats(),
+            }
+
+
+class RelativesBatcher:
+    # Relatives requests that queue up together (up to size of them, waiting
+    # at most window seconds for more) are scored together on this thread: one
+    # PedigreeGraph.related_many pass for every distinct mare in the batch,
+    # then each mare's top relatives as in find_relatives.
+    def __init__(self, service, window=BATCH_WINDOW_MS / 1000, size=BATCH_SIZE):
+        self.service = service
+        self.window = window
+        self.size = max(size, 1)
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="relatives-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, mare_name):
+        future = Future()
+        self.requests.put((mare_name, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.size:
+            try:
+                batch.append(self.requests.get(timeout=max(deadline - time.perf_counter(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._score(batch)
+            except Exception as e:
+                logger.exception("Relatives batch of %d failed", len(batch))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _score(self, batch):
+        s = self.service
+        found = {}  # requested name -> the mare's registered name
+        for name, _ in batch:
+            row = s.mare_names.lookup(name)
+            if row is not None:
+                found[name] = s.mare_names.names[row]
+        mares = list(dict.fromkeys(found.values()))
+        s.metrics.batch(len(batch), len(mares))
+        with trace_request("relatives_batch", requests=len(batch), mares=len(mares)):
+            related = dict(zip(mares, s.graph.related_many(mares, s.offspring_index.producing_mare_rows))) if mares else {}
+            for name, future in batch:
+                result = None
+                if name in found:
+                    events = iter_relatives(
+                        s.df, name, s.offspring_index, s.graph, s.mare_names, TOP_N, related=related[found[name]]
+                    )
+                    result = collect_relatives(events)
+                    key = s.relatives_key(name)
+                    if key is not None:
+                        results.put(key, result)
+                future.set_result(result)
+
+
+class RecommendService:
+    # The registry and every index the recommenders use, loaded once and shared
+    # by all requests; the HTTP handler only maps endpoints onto these methods.
+    def __init__(self, df, batch_window=BATCH_WINDOW_MS / 1000, batch_size=BATCH_SIZE):
+        self.df = df
+        for index_cls, index_args in PREBUILT:
+            cached_index(index_cls, df, *index_args)
+        self.offspring_index = cached_index(DamOffspringIndex, df)
+        self.graph = cached_index(PedigreeGraph, df)
+        self.mare_names = cached_index(NameIndex, df, "Mare")
+        self.nick_stats = cached_index(NickStats, df)
+        self.metrics = Metrics()
+        self.batcher = RelativesBatcher(self, batch_window, batch_size)
+
+    def relatives_key(self, mare_name):
+        # The web app's result_cache key, so both share their results
+        return result_key("app", self.df, mare_name, "kinship", self.graph.max_depth)
+
+    def health(self, params):
+        return {"status": "ok", "version": dataset_version(self.df), "rows": len(self.df)}
+
+    def metrics_report(self, params):
+        return {"version": dataset_version(self.df), "rows": len(self.df), **self.metrics.to_dict()}
+
+    def search(self, params):
+        return {"names": self.mare_names.search(params.get("q", ""), int(params.get("limit", 20)))}
+
+    def recommend(self, params):
+        return build_recommendation(self.df, _required(params, "mare"))
+
+    def relatives(self, params):
+        mare_name = _required(params, "mare")
+        key = self.relatives_key(mare_name)
+        result = results.get(key) if key is not None else None
+        if result is None:
+            result = self.batcher.submit(mare_name).result()
+        return {"result": result}
+
+    def stallions(self, params):
+        offspring = self.offspring_index.offspring(_required(params, "name"))
+        broodmare_sire = params.get("broodmare_sire")
+        return {"stallions": top_stallions_for(offspring, nick_stats=self.nick_stats, broodmare_sire=broodmare_sire)}
+
+
+def _required(params, field):
+    value = params.get(field)
+    if not isinstance(value, str) or not value:
+        raise ValueError(f"'{field}' is required")
+    return value
+
+
+ROUTES = {
+    ("GET", "/health"): RecommendService.health,
+    ("GET", "/metrics"): RecommendService.metrics_report,
+    ("GET", "/search"): RecommendService.search,
+    ("POST", "/recommend"): RecommendService.recommend,
+    ("POST", "/relatives"): RecommendService.relatives,
+    ("POST", "/stallions"): RecommendService.stallions,
+}
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    # GET parameters come from the query string, POST ones from a JSON object body
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method):
+        url = urllib.parse.urlsplit(self.path)
+        route = ROUTES.get((method, url.path))
+        if route is None:
+            self._reply(404, {"error": f"No such endpoint: {method} {url.path}"})
+            return
+        service = self.server.service
+        service.metrics.begin()
+        start = time.perf_counter()
+        status = 200
+        try:
+            if method == "GET":
+                params = dict(urllib.parse.parse_qsl(url.query))
+            else:
+                params = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                if not isinstance(params, dict):
+                    raise ValueError("expected a JSON object")
+            body = _jsonable(route(service, params))
+        except ValueError as e:
+            status, body = 400, {"error": str(e)}
+        except Exception as e:
+            logger.exception("%s %s failed", method, url.path)
+            status, body = 500, {"error": f"{type(e).__name__}: {e}"}
+        service.metrics.end(url.path, time.perf_counter() - start, status != 200)
+        self._reply(status, body)
+
+    def _reply(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class ServiceServer(ThreadingHTTPServer):
+    # A thread per connection; scoring itself is shared through the batcher.
+    # The default listen backlog of 5 resets bursts of simultaneous clients.
+    request_queue_size = 128
+
+
+def serve(service, host=HOST, port=PORT):
+    server = ServiceServer((host, port), ServiceHandler)
+    server.service = service
+    return server
+
+
+def _missing(value):
+    return np.nan if value is None else value
+
+
+def _horse(record):
+    # A horse row as the recommenders return it: a Series with a Timestamp birth date
+    if record is None:
+        return None
+    row = pd.Series({k: _missing(v) for k, v in record.items()}, dtype=object)
+    if "Birth Date" in row:
+        row["Birth Date"] = pd.to_datetime(row["Birth Date"], errors="coerce")
+    return row
+
+
+class ServiceClient:
+    # Thin client of a running service, returning the same shapes as the
+    # in-process calls (build_recommendation, collect_relatives,
+    # top_stallions_for). Connection and service errors raise OSError.
+    def __init__(self, url=SERVICE_URL, timeout=120):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        # Never route through an HTTP proxy: the service is on this machine
+        self.opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+    def _call(self, path, payload=None, **query):
+        url = self.url + path + ("?" + urllib.parse.urlencode(query) if query else "")
+        data = None if payload is None else json.dumps(payload).encode("utf-8")
+        request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.load(e).get("error")
+            except ValueError:
+                message = e.reason
+            raise OSError(f"Recommendation service error {e.code}: {message}") from e
+
+    def health(self):
+        return self._call("/health")
+
+    def metrics(self):
+        return self._call("/metrics")
+
+    def search(self, fragment, limit=20):
+        return self._call("/search", q=fragment, limit=limit)["names"]
+
+    def recommend(self, mare_name):
+        recommendation = self._call("/recommend", {"mare": mare_name})
+        recommendation["mare"] = _horse(recommendation["mare"])
+        recommendation["stallions"] = [{k: _missing(v) for k, v in s.items()} for s in recommendation["stallions"]]
+        for stallion in recommendation["stallions"]:
+            stallion["Birth Date"] = pd.to_datetime(stallion["Birth Date"], errors="coerce")
+        return recommendation
+
+    def relatives(self, mare_name):
+        result = self._call("/relatives", {"mare": mare_name})["result"]
+        if result is None:
+            return None
+        relatives = [(*relative[:4], _horse(relative[4]), *relative[5:]) for relative in result["relatives"]]
+        return {"mare": _horse(result["mare"]), "relatives": relatives}
+
+    def stallions(self, name, broodmare_sire=None):
+        stallions = self._call("/stallions", {"name": name, "broodmare_sire": _jsonable(broodmare_sire)})["stallions"]
+        return [
+            (sire, total, [tuple(foal) for foal in foals], None if record is None else {k: _missing(v) for k, v in record.items()})
+            for sire, total, foals, record in stallions
+        ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve recommendations over local HTTP/JSON from one warm process.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--batch-window-ms", type=float, default=BATCH_WINDOW_MS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="most relatives requests scored together")
+    parser.add_argument("--offline", action="store_true", help="start from the local snapshot without downloading")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    start = time.perf_counter()
+    df = load_horses(offline=args.offline or None)
+    service = RecommendService(df, args.batch_window_ms / 1000, args.batch_size)
+    print(f"🐎 {len(df):,} horses loaded and indexed in {time.perf_counter() - start:.1f}s (version {dataset_version(df)})")
+    server = serve(service, args.host, args.port)
+    print(f"✅ Serving on http://{args.host}:{server.server_port} (GET /health /metrics /search, POST /recommend /relatives /stallions)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
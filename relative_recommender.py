@@ -0,0 +1,221 @@
+import threading
+
+import pandas as pd
+
+from horse_index import DamOffspringIndex, LineageIndex, NameIndex
+from nick_stats import NickStats
+from pedigree_engine import PEDIGREE_WEIGHTS, PedigreeGraph, top_k
+from profiling import Laps, trace_request
+
+TOP_N = 5  # relatives per app result
+# Indexes the recommenders cache per frame; the service and delta ingest build them up front
+PREBUILT = [
+    (LineageIndex, ()),
+    (DamOffspringIndex, ()),
+    (NameIndex, ()),
+    (NameIndex, ("Mare",)),
+    (PedigreeGraph, ()),
+    (NickStats, ()),
+]
+
+
+def build_pedigree_tree():
+    return dict(PEDIGREE_WEIGHTS)
+
+
+def ancestry_breakdown(pedigree_graph, m1_row, m2_row, limit=10):
+    # The nearest ancestors the two horses share, closest first.
+    shared = pedigree_graph.common_ancestors(
+        pedigree_graph.node(m1_row["Horse Name"]), pedigree_graph.node(m2_row["Horse Name"])
+    )
+    breakdown = [
+        f"✅ {pedigree_graph.vocab[ancestor]} (generations back: {back1} from {m1_row['Horse Name']}, {back2} from {m2_row['Horse Name']})"
+        for ancestor, back1, back2 in shared[:limit]
+    ]
+    if len(shared) > limit:
+        breakdown.append(f"… and {len(shared) - limit} more shared ancestors")
+    return breakdown
+
+
+def classify_relationship(mare_row, relative_row):
+    if mare_row["Horse Name"] == relative_row["Horse Name"]:
+        return "Self"
+    # Direct female line, which kinship ranks as closely as full sisters
+    if relative_row["Horse Name"] == mare_row["Dam (Mother)"]:
+        return "Dam"
+    if relative_row["Dam (Mother)"] == mare_row["Horse Name"]:
+        return "Daughter"
+    if relative_row["Horse Name"] == mare_row["Maternal Granddam"]:
+        return "Granddam"
+    if relative_row["Maternal Granddam"] == mare_row["Horse Name"]:
+        return "Granddaughter"
+    if mare_row["Sire (Father)"] == relative_row["Sire (Father)"] and mare_row["Dam (Mother)"] == relative_row["Dam (Mother)"]:
+        return "Full Sister"
+    if mare_row["Sire (Father)"] == relative_row["Sire (Father)"]:
+        return "Half Sister (Paternal)"
+    if mare_row["Dam (Mother)"] == relative_row["Dam (Mother)"]:
+        return "Half Sister (Maternal)"
+
+    pedigree_map = build_pedigree_tree()
+    maternal_labels = [k for k in pedigree_map if "Dam" in k]
+    paternal_labels = [k for k in pedigree_map if "Sire" in k and not k.startswith("Dam")]
+
+    for level in range(2, 5):
+        shared_maternal = any(mare_row[col] == relative_row[col] for col in maternal_labels if f"{level}th" not in col and pd.notna(mare_row[col]) and mare_row[col] == relative_row[col])
+        shared_paternal = any(mare_row[col] == relative_row[col] for col in paternal_labels if f"{level}th" not in col and pd.notna(mare_row[col]) and mare_row[col] == relative_row[col])
+        if shared_paternal:
+            return f"{level}rd Degree Paternal Relative" if level == 3 else f"{level}th Degree Paternal Relative"
+        if shared_maternal:
+            return f"{level}rd Degree Maternal Relative" if level == 3 else f"{level}th Degree Maternal Relative"
+
+    return "Distant Lineage Relative"
+
+
+def top_stallions_for(offspring, limit=5, nick_stats=None, broodmare_sire=None):
+    # Sires one dam was bred to, with every foal of each pairing. With nick_stats
+    # they are ranked by their production record with mares by broodmare_sire
+    # (NickStats.rank) and each carries that record; otherwise by best-earning foal.
+    offspring = offspring[["Horse Name", "Sire (Father)", "Total Earnings (USD)"]]
+    if nick_stats is None:
+        top = offspring.sort_values("Total Earnings (USD)", ascending=False).drop_duplicates("Sire (Father)").head(limit)
+        records = dict.fromkeys(top["Sire (Father)"])
+    else:
+        ranking = nick_stats.rank(offspring["Sire (Father)"], broodmare_sire, limit)
+        records = ranking[["basis", "starters", "earners", "earnings_per_starter", "earnings_index"]].to_dict("index")
+    stallions = []
+    for sire, record in records.items():
+        pair = offspring[offspring["Sire (Father)"] == sire]
+        foals = list(zip(pair["Horse Name"], pair["Total Earnings (USD)"]))
+        stallions.append((sire, pair["Total Earnings (USD)"].sum(), foals, record))
+    return stallions
+
+
+def find_relatives(df, mare_name, offspring_index=None, pedigree_graph=None, mare_names=None, top_n=TOP_N, nick_stats=None):
+    # Everything the app renders for one mare: {"mare", "relatives", "stallions"},
+    # or None when the mare is unknown. relatives are
+    # (name, display, perc, earnings, row, breakdown, label) tuples and
+    # stallions[i] holds (sire, total earnings, [(foal, earnings)], record) for
+    # relatives[i], ranked by each sire's record with mares by her sire,
+    # and perc is the additive relationship (2 x kinship) in %.
+    with trace_request("app", mare=mare_name):
+        if offspring_index is None:
+            offspring_index = DamOffspringIndex(df)
+        if nick_stats is None:
+            nick_stats = NickStats(df)
+        result = collect_relatives(iter_relatives(df, mare_name, offspring_index, pedigree_graph, mare_names, top_n))
+        if result is None:
+            return None
+        laps = Laps()
+        offspring = [offspring_index.offspring(name) for name, *_ in result["relatives"]]
+        broodmare_sire = result["mare"]["Sire (Father)"]
+        result["stallions"] = [top_stallions_for(foals, 5, nick_stats, broodmare_sire) for foals in offspring]
+        laps.lap("offspring_aggregation", offspring_rows=sum(len(foals) for foals in offspring))
+        return result
+
+
+def collect_relatives(events):
+    # {"mare", "relatives"} from iter_relatives' events, None for an unknown mare.
+    mare_info, relatives = None, []
+    for event, *payload in events:
+        if event == "mare":
+            mare_info = payload[0]
+        elif event == "relative":
+            relatives.append(payload[0])
+    return None if mare_info is None else {"mare": mare_info, "relatives": relatives}
+
+
+def iter_relatives(df, mare_name, offspring_index=None, pedigree_graph=None, mare_names=None, top_n=TOP_N, related=None):
+    # find_relatives without the offspring aggregation, as a stream of events for
+    # callers that render while the rest is still being worked out (related:
+    # her relationship % with every offspring_index.producing_mare_rows mare,
+    # when the caller already scored it, e.g. in a PedigreeGraph.related_many batch):
+    #   ("mare", mare_info)           as soon as the mare is found
+    #   ("relative", relative)        "Self" straight away, when she has produced earners
+    #   ("scored", candidates, total) after the kinship pass; total relatives, Self included
+    #   ("relative", relative)        each top relative, best first
+    # An unknown mare yields nothing.
+    laps = Laps()
+    if offspring_index is None:
+        offspring_index = DamOffspringIndex(df)
+    if pedigree_graph is None:
+        pedigree_graph = PedigreeGraph(df)
+    if mare_names is None:
+        mare_names = NameIndex(df, gender="Mare")
+
+    laps.lap("indexes", rows=len(df))
+    row = mare_names.lookup(mare_name)
+    laps.lap("mare_lookup")
+    if row is None:
+        return
+    mare_info = df.iloc[row]
+    yield "mare", mare_info
+
+    relatives = 0
+    mare_earnings = offspring_index.earnings(mare_info["Horse Name"])
+    if mare_earnings > 0:
+        relatives += 1
+        yield "relative", (mare_info["Horse Name"], f"{mare_info['Horse Name']} (Self)", None, mare_earnings, mare_info, [], "Self")
+
+    # Every producing mare is scored in one batch kinship pass; breakdown and
+    # relationship label are only worked out for the final top relatives.
+    names = mare_names.names
+    k = top_n - relatives
+    rows = offspring_index.producing_mare_rows
+    others = names[rows] != mare_info["Horse Name"]
+    rows = rows[others]
+    if related is None:
+        percentages = pedigree_graph.related(mare_info, rows)
+        laps.restart()
+    else:
+        percentages = related[others]
+    related = percentages > 0
+    top = top_k(rows[related], percentages[related], k)
+    # Fewer related mares than slots: pad with unrelated ones (0%) in file order
+    top += [(r, 0.0) for r in rows[~related][:k - len(top)]]
+
+    laps.lap("top_k", candidates=int(related.sum()))
+    yield "scored", int(related.sum()), relatives + len(top)
+
+    for r, perc in top:
+        row = df.iloc[r]
+        breakdown = ancestry_breakdown(pedigree_graph, mare_info, row)
+        label = classify_relationship(mare_info, row)
+        earnings = offspring_index.earnings(row["Horse Name"])
+        yield "relative", (row["Horse Name"], row["Horse Name"], perc, earnings, row, breakdown, label)
+
+    laps.lap("breakdown", relatives=relatives + len(top))
+
+
+class RelativesJob:
+    # Runs iter_relatives on an executor thread so the caller (the Streamlit
+    # script thread) only polls: events() is everything produced so far, and
+    # on_result gets the collect_relatives() result once the stream is done.
+    # key is the caller's result_cache key for the job (None: not cacheable).
+    def __init__(self, executor, df, mare_name, *args, key=None, on_result=None, **kwargs):
+        self.key = key
+        self.mare_name = mare_name
+        self.trace = None
+        self._events = []
+        self._lock = threading.Lock()
+        self._on_result = on_result
+        self.future = executor.submit(self._run, df, mare_name, args, kwargs)
+
+    def _run(self, df, mare_name, args, kwargs):
+        with trace_request("app", mare=mare_name) as self.trace:
+            for event in iter_relatives(df, mare_name, *args, **kwargs):
+                with self._lock:
+                    self._events.append(event)
+        if self._on_result is not None:
+            self._on_result(collect_relatives(self.events()))
+
+    def events(self):
+        with self._lock:
+            return list(self._events)
+
+    def done(self):
+        return self.future.done()
+
+    def result(self):
+        # Re-raises whatever the worker thread raised
+        self.future.result()
+        return collect_relatives(self.events())
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+from data_loader import dataset_version
+from horse_index import normalize_name
+
+# ✅ Set STALLION_RESULT_CACHE_DIR to keep recommendation results across restarts
+CACHE_DIR = os.environ.get("STALLION_RESULT_CACHE_DIR") or None
+MAX_ENTRIES = int(os.environ.get("STALLION_RESULT_CACHE_SIZE", "256"))
+
+_ON_DISK = object()
+_MISSING = object()
+
+
+class ResultCache:
+    # Thread-safe LRU of recommendation results, bounded to max_entries. With a
+    # directory every entry is also pickled to <dir>/<digest>.pkl, evicted files
+    # are deleted, and a restarted process picks the surviving files back up.
+    def __init__(self, max_entries=MAX_ENTRIES, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.keys = {}  # digest -> key, for entries put by this process
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.disk_hits = self.evictions = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            files = [f for f in os.listdir(directory) if f.endswith(".pkl")]
+            files.sort(key=lambda f: os.path.getmtime(os.path.join(directory, f)))
+            for f in files:
+                self.entries[f[:-4]] = _ON_DISK
+            self._evict()
+
+    @staticmethod
+    def digest(key):
+        return hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:32]
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest + ".pkl")
+
+    def _evict(self):
+        while len(self.entries) > self.max_entries:
+            digest, _ = self.entries.popitem(last=False)
+            self.keys.pop(digest, None)
+            self.evictions += 1
+            if self.directory:
+                try:
+                    os.remove(self._path(digest))
+                except FileNotFoundError:
+                    pass
+
+    def get(self, key, default=None):
+        digest = self.digest(key)
+        with self.lock:
+            value = self.entries.get(digest, _MISSING)
+            if value is _ON_DISK:
+                try:
+                    with open(self._path(digest), "rb") as f:
+                        value = self.entries[digest] = pickle.load(f)
+                    self.disk_hits += 1
+                except (OSError, pickle.UnpicklingError, EOFError):
+                    del self.entries[digest]
+                    value = _MISSING
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.entries.move_to_end(digest)
+            return value
+
+    def put(self, key, value):
+        digest = self.digest(key)
+        with self.lock:
+            self.entries[digest] = value
+            self.keys[digest] = key
+            self.entries.move_to_end(digest)
+            if self.directory:
+                tmp = self._path(digest) + ".part"
+                with open(tmp, "wb") as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp, self._path(digest))
+            self._evict()
+
+    def get_or_compute(self, key, compute):
+        # key=None means "not cacheable" (e.g. a frame with no dataset version).
+        if key is None:
+            return compute()
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def carry_over(self, old_version, new_version, keep):
+        # Re-files results computed for one dataset version under another, for
+        # the (key, value) pairs keep() accepts (e.g. mares a small update did
+        # not touch). Returns (kept, dropped) counts; entries only on disk are
+        # not considered, since their keys are unknown.
+        candidates = self.items_for(old_version)
+        kept = [(key, value) for key, value in candidates if keep(key, value)]
+        for key, value in kept:
+            self.put((key[0], new_version) + key[2:], value)
+        return len(kept), len(candidates) - len(kept)
+
+    def items_for(self, version):
+        # [(key, value)] held in memory for one dataset version
+        with self.lock:
+            return [
+                (key, self.entries[digest])
+                for digest, key in self.keys.items()
+                if key[1] == version and self.entries.get(digest, _ON_DISK) is not _ON_DISK
+            ]
+
+    def clear(self):
+        with self.lock:
+            for digest in list(self.entries):
+                if self.directory:
+                    try:
+                        os.remove(self._path(digest))
+                    except FileNotFoundError:
+                        pass
+            self.entries.clear()
+            self.keys.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+            }
+
+
+def result_key(kind, df, mare_name, *extra):
+    # (recommender, dataset content hash, folded mare name); None for frames that
+    # did not come from the loader, since their content cannot be identified.
+    version = dataset_version(df)
+    if version is None:
+        return None
+    return (kind, version, normalize_name(mare_name)) + extra
+
+
+# Shared by both recommenders for the life of the process
+results = ResultCache(MAX_ENTRIES, CACHE_DIR)
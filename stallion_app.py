@@ -2,6 +2,16 @@ import streamlit as st
 import pandas as pd
 import streamlit.components.v1 as components
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from data_loader import dataset_version, load_horses
+from horse_index import DamOffspringIndex, NameIndex
+from nick_stats import NickStats
+from pedigree_engine import KINSHIP_DEPTH, PedigreeGraph
+from relative_recommender import RelativesJob, top_stallions_for
+from profiling import Laps, trace_request
+from recommend_service import SERVICE_URL, ServiceClient
+from result_cache import result_key, results
 
 # ✅ Umami analytics tracking
 umami_script = """
@@ -9,137 +19,108 @@ umami_script = """
 """
 components.html(umami_script, height=0, width=0)
 
-# ✅ Load dataset
-df = pd.read_csv("https://drive.google.com/uc?id=14A-2Pz2ILnUB_hQF1PJ3EB073QcDhNsi&export=download")
-df["Birth Date"] = pd.to_datetime(df["Birth Date"], errors="coerce")
+@st.cache_resource
+def load_offspring_index(version, _df):
+    return DamOffspringIndex(_df)
+
+@st.cache_resource
+def load_pedigree_graph(version, _df):
+    return PedigreeGraph(_df)
+
+@st.cache_resource
+def load_mare_names(version, _df):
+    return NameIndex(_df, gender="Mare")
+
+@st.cache_resource
+def load_nick_stats(version, _df):
+    return NickStats(_df)
+
+@st.cache_resource
+def load_executor():
+    # Relatives are worked out here, off the script thread
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="relatives")
+
+@st.cache_resource(max_entries=1024)
+def load_stallions(version, name, broodmare_sire, _offspring_index, _nick_stats):
+    return top_stallions_for(_offspring_index.offspring(name), nick_stats=_nick_stats, broodmare_sire=broodmare_sire)
+
+# ✅ Load dataset (typed local snapshot, shared by every session in this process).
+# Reruns hit the caches, so this trace is only shown in the debug panel, not logged.
+# With STALLION_SERVICE_URL set the app is a thin client of recommend_service.py
+# and loads nothing itself.
+service = ServiceClient(SERVICE_URL) if SERVICE_URL else None
+with trace_request("app_load", emit_on_exit=False) as load_trace:
+    load_laps = Laps()
+    if service is None:
+        df = load_horses()
+        load_laps.lap("load_horses", rows=len(df))
+        offspring_index = load_offspring_index(dataset_version(df), df)
+        pedigree_graph = load_pedigree_graph(dataset_version(df), df)
+        mare_names = load_mare_names(dataset_version(df), df)
+        nick_stats = load_nick_stats(dataset_version(df), df)
+        load_laps.lap("indexes")
+    else:
+        try:
+            service.health()
+        except OSError as e:
+            st.error(f"❌ Recommendation service at {SERVICE_URL} is not reachable: {e}")
+            st.stop()
+        load_laps.lap("service_health")
 
 st.title("🐎 Stallion Recommendation System")
 
-mare_options = df[df["Horse Gender"] == "Mare"]["Horse Name"].dropna().unique()
+# Only the first matches for the typed fragment are sent to the browser
+mare_query = st.text_input("Search mares by name")
+mare_options = mare_names.search(mare_query, limit=50) if service is None else service.search(mare_query, limit=50)
 selected_mare = st.selectbox("Select a Mare", mare_options)
-
-def recommend_stallions(df, mare_name):
-    def get_mare_info(name):
-        mare = df[(df["Horse Name"].str.upper() == name.upper()) & (df["Horse Gender"] == "Mare")]
-        return mare.iloc[0] if not mare.empty else None
-
-    def build_pedigree_tree():
-        return {
-            "Sire (Father)": 0.50, "Dam (Mother)": 0.50,
-            "Paternal Grandsire": 0.25, "Paternal Granddam": 0.25,
-            "Maternal Grandsire": 0.25, "Maternal Granddam": 0.25,
-            "Great Grandsire (Sire's Sire)": 0.125, "Great Granddam (Sire's Sire's Dam)": 0.125,
-            "Great Grandsire (Sire's Dam's Sire)": 0.125, "Great Granddam (Sire's Dam's Dam)": 0.125,
-            "Great Grandsire (Dam's Sire)": 0.125, "Great Granddam (Dam's Sire's Dam)": 0.125,
-            "Great Grandsire (Dam's Dam's Sire)": 0.125, "Great Granddam (Dam's Dam's Dam)": 0.125,
-            "Great-Great Grandsire (Sire's Sire's Sire)": 0.0625, "Great-Great Granddam (Sire's Sire's Dam)": 0.0625,
-            "Great-Great Grandsire (Sire's Sire's Dam's Sire)": 0.0625, "Great-Great Granddam (Sire's Sire's Dam's Dam)": 0.0625,
-            "Great-Great Grandsire (Sire's Dam's Sire)": 0.0625, "Great-Great Granddam (Sire's Dam's Dam)": 0.0625,
-            "Great-Great Grandsire (Sire's Dam's Dam's Sire)": 0.0625, "Great-Great Granddam (Sire's Dam's Dam's Dam)": 0.0625,
-            "Great-Great Grandsire (Dam's Sire's Sire)": 0.0625, "Great-Great Granddam (Dam's Sire's Dam)": 0.0625,
-            "Great-Great Grandsire (Dam's Sire's Dam's Sire)": 0.0625, "Great-Great Granddam (Dam's Sire's Dam's Dam)": 0.0625,
-            "Great-Great Grandsire (Dam's Dam's Sire)": 0.0625, "Great-Great Granddam (Dam's Dam's Dam)": 0.0625,
-            "Great-Great Grandsire (Dam's Dam's Dam's Sire)": 0.0625, "Great-Great Granddam (Dam's Dam's Dam's Dam)": 0.0625,
-        }
-
-    def get_ancestor_score_map(horse_row):
-        pedigree_map = build_pedigree_tree()
-        score_map = {}
-        label_map = {}
-        for ancestor_col, score in pedigree_map.items():
-            ancestor_name = horse_row.get(ancestor_col)
-            if pd.notna(ancestor_name):
-                if ancestor_name not in score_map:
-                    score_map[ancestor_name] = []
-                    label_map[ancestor_name] = []
-                score_map[ancestor_name].append(score)
-                label_map[ancestor_name].append(ancestor_col)
-        return score_map, label_map
-
-    def calculate_pedigree_percentage(m1_row, m2_row):
-        map1, labels1 = get_ancestor_score_map(m1_row)
-        map2, labels2 = get_ancestor_score_map(m2_row)
-
-        common_ancestors = set(map1.keys()) & set(map2.keys())
-        breakdown = []
-        total_score = 0
-
-        for ancestor in common_ancestors:
-            avg_score = (sum(map1[ancestor]) / len(map1[ancestor]) + sum(map2[ancestor]) / len(map2[ancestor])) / 2
-            total_score += avg_score
-            combined_label = set(labels1[ancestor]) | set(labels2[ancestor])
-            breakdown.append(f"✅ {ancestor} (matched at: {', '.join(combined_label)}) — averaged contribution = {avg_score:.4f}")
-
-        pedigree_percent = round(((total_score / 4) * 100), 2)
-        return pedigree_percent, breakdown
-
-    def classify_relationship(mare_row, relative_row):
-        if mare_row["Horse Name"] == relative_row["Horse Name"]:
-            return "Self"
-        if mare_row["Sire (Father)"] == relative_row["Sire (Father)"] and mare_row["Dam (Mother)"] == relative_row["Dam (Mother)"]:
-            return "Full Sister"
-        if mare_row["Sire (Father)"] == relative_row["Sire (Father)"]:
-            return "Half Sister (Paternal)"
-        if mare_row["Dam (Mother)"] == relative_row["Dam (Mother)"]:
-            return "Half Sister (Maternal)"
-
-        pedigree_map = build_pedigree_tree()
-        maternal_labels = [k for k in pedigree_map if "Dam" in k]
-        paternal_labels = [k for k in pedigree_map if "Sire" in k and not k.startswith("Dam")]
-
-        for level in range(2, 5):
-            shared_maternal = any(mare_row[col] == relative_row[col] for col in maternal_labels if f"{level}th" not in col and pd.notna(mare_row[col]) and mare_row[col] == relative_row[col])
-            shared_paternal = any(mare_row[col] == relative_row[col] for col in paternal_labels if f"{level}th" not in col and pd.notna(mare_row[col]) and mare_row[col] == relative_row[col])
-            if shared_paternal:
-                return f"{level}rd Degree Paternal Relative" if level == 3 else f"{level}th Degree Paternal Relative"
-            if shared_maternal:
-                return f"{level}rd Degree Maternal Relative" if level == 3 else f"{level}th Degree Maternal Relative"
-
-        return "Distant Lineage Relative"
-
-    def get_offspring(mare_names):
-        return df[df["Dam (Mother)"].isin(mare_names)]
-
-    mare_info = get_mare_info(mare_name)
-    if mare_info is None:
-        st.error("Mare not found.")
+show_timings = st.checkbox("Show timing details")
+
+def relative_title(name, perc, rel_type):
+    return f"🐴 {name} ({rel_type}) — {perc:.2f}%" if perc is not None else f"🐴 {name} (Self)"
+
+def render_mare(mare_info):
+    st.subheader("📋 Mare Information")
+    st.write(f"• Name: {mare_info['Horse Name']}")
+    st.write(f"• Registration #: {mare_info['Horse Registration Number']}")
+    st.write(f"• Birth Date: {mare_info['Birth Date'].date() if pd.notna(mare_info['Birth Date']) else 'N/A'}")
+    st.write(f"• Sire: {mare_info['Sire (Father)']}")
+    st.write(f"• Dam: {mare_info['Dam (Mother)']}")
+    st.write(f"• Earnings: ${mare_info['Total Earnings (USD)']:,.2f}")
+    st.markdown(f"[Pedigree Link]({mare_info['Pedigree Link']})")
+
+def render_record(record, broodmare_sire):
+    if record["basis"] == "unproven":
+        st.write(f"• Record: only {record['starters']:.0f} recorded starters, not yet proven")
         return
+    scope = f"with mares by {broodmare_sire}" if record["basis"] == "nick" else "with all mares"
+    st.write(
+        f"• Record {scope}: {record['starters']:.0f} starters, {record['earners']:.0f} earners, "
+        f"${record['earnings_per_starter']:,.2f} per starter (index {record['earnings_index']:.2f})"
+    )
+
+def render_stallions(name, broodmare_sire):
+    if service is None:
+        top_stallions = load_stallions(dataset_version(df), name, broodmare_sire, offspring_index, nick_stats)
+    else:
+        top_stallions = service.stallions(name, broodmare_sire)
+    if not top_stallions:
+        st.info("No offspring data available.")
+        return
+    stallion_tabs = st.tabs([f"🧬 {s}" for s, _, _, _ in top_stallions])
+    for j, (sire, total, foals, record) in enumerate(top_stallions):
+        with stallion_tabs[j]:
+            st.subheader(f"{name} x {sire}")
+            st.write(f"• Total Earnings: ${total:,.2f}")
+            render_record(record, broodmare_sire)
+            for foal, earnings in foals:
+                st.markdown(f"• **{foal}** earned ${earnings:,.2f}")
+            st.markdown("---")
 
-    relatives = []
-    mare_earnings = get_offspring([mare_info["Horse Name"]])["Total Earnings (USD)"].sum()
-    if mare_earnings > 0:
-        relatives.append((mare_info["Horse Name"], f"{mare_info['Horse Name']} (Self)", None, mare_earnings, mare_info, [], "Self"))
-
-    mares = df[df["Horse Gender"] == "Mare"].copy()
-    for _, row in mares.iterrows():
-        if row["Horse Name"] == mare_info["Horse Name"]:
-            continue
-        earnings = get_offspring([row["Horse Name"]])["Total Earnings (USD)"].sum()
-        if earnings > 0:
-            perc, breakdown = calculate_pedigree_percentage(mare_info, row)
-            label = classify_relationship(mare_info, row)
-            relatives.append((row["Horse Name"], row["Horse Name"], perc, earnings, row, breakdown, label))
-
-    relatives_sorted = sorted(relatives, key=lambda x: (-x[2] if x[2] is not None else float('-inf')))
-    top_relatives = relatives_sorted[:5]
-
-    tabs = ["📋 Mare Info", "📊 Pedigree % Breakdown"] + [
-        f"🐴 {name} ({rel_type}) — {perc:.2f}%" if perc is not None else f"🐴 {name} (Self)"
-        for name, _, perc, _, _, _, rel_type in top_relatives
-    ]
+def render_relatives(mare_info, top_relatives):
+    tabs = ["📊 Pedigree % Breakdown"] + [relative_title(name, perc, rel_type) for name, _, perc, _, _, _, rel_type in top_relatives]
     st_tabs = st.tabs(tabs)
 
     with st_tabs[0]:
-        st.subheader("Mare Information")
-        st.write(f"• Name: {mare_info['Horse Name']}")
-        st.write(f"• Registration #: {mare_info['Horse Registration Number']}")
-        st.write(f"• Birth Date: {mare_info['Birth Date'].date() if pd.notna(mare_info['Birth Date']) else 'N/A'}")
-        st.write(f"• Sire: {mare_info['Sire (Father)']}")
-        st.write(f"• Dam: {mare_info['Dam (Mother)']}")
-        st.write(f"• Earnings: ${mare_info['Total Earnings (USD)']:,.2f}")
-        st.markdown(f"[Pedigree Link]({mare_info['Pedigree Link']})")
-
-    with st_tabs[1]:
         st.subheader("📊 Pedigree % Breakdown")
         for name, _, perc, _, _, breakdown, rel_type in top_relatives:
             if perc is None:
@@ -150,30 +131,123 @@ def recommend_stallions(df, mare_name):
                     st.write(line)
             st.markdown("---")
 
-    for i, (name, _, perc, _, _, _, rel_type) in enumerate(top_relatives, start=2):
+    for i, (name, _, perc, _, _, _, rel_type) in enumerate(top_relatives, start=1):
         with st_tabs[i]:
             if perc is None:
                 st.subheader(f"Recommendations for {name} — 100% Pedigree (Self)")
             else:
                 st.subheader(f"Recommendations for {name} ({rel_type}) — {perc:.2f}%")
-            offspring = get_offspring([name])
-            if offspring.empty:
-                st.info("No offspring data available.")
-                continue
-            top_stallions = offspring.sort_values("Total Earnings (USD)", ascending=False).drop_duplicates("Sire (Father)").head(5)
-            stallion_tabs = st.tabs([f"🧬 {s}" for s in top_stallions["Sire (Father)"]])
-            for j, sire in enumerate(top_stallions["Sire (Father)"]):
-                with stallion_tabs[j]:
-                    pair = offspring[offspring["Sire (Father)"] == sire]
-                    total = pair["Total Earnings (USD)"].sum()
-                    st.subheader(f"{name} x {sire}")
-                    st.write(f"• Total Earnings: ${total:,.2f}")
-                    for _, row in pair.iterrows():
-                        st.markdown(f"• **{row['Horse Name']}** earned ${row['Total Earnings (USD)']:,.2f}")
-                    st.markdown("---")
-
-if st.button("Recommend Stallions"):
-    start_time = time.time()
-    with st.spinner("⏳ Generating stallion recommendations..."):
-        recommend_stallions(df, selected_mare)
-    st.success(f"✅ Recommendations ready in {time.time() - start_time:.2f} seconds!")
+            # Stallion sub-tabs are only built for the relatives a breeder opens
+            if st.toggle("🧬 Show stallion pairings", key=f"stallions-{mare_info['Horse Name']}-{name}"):
+                render_stallions(name, mare_info["Sire (Father)"])
+    return len(tabs)
+
+def stream_relatives(job, mare_area, live):
+    # Draws the mare and each relative's headline as the job produces them.
+    progress = st.progress(0.0, text="⏳ Looking up the mare...")
+    shown, mare_shown = 0, False
+    while True:
+        finished = job.done()
+        mare_info, relatives, total = None, [], None
+        for event, *payload in job.events():
+            if event == "mare":
+                mare_info = payload[0]
+            elif event == "relative":
+                relatives.append(payload[0])
+            elif event == "scored":
+                total = payload[1]
+        if mare_info is not None and not mare_shown:
+            with mare_area.container():
+                render_mare(mare_info)
+            mare_shown = True
+        if total is None:
+            progress.progress(0.0, text="⏳ Scoring relatives by kinship...")
+        else:
+            progress.progress(len(relatives) / max(total, 1), text=f"⏳ {len(relatives)} of {total} relatives ready")
+        if len(relatives) > shown:
+            with live.container():
+                for name, _, perc, _, _, _, rel_type in relatives:
+                    st.markdown(relative_title(name, perc, rel_type))
+            shown = len(relatives)
+        if finished:
+            break
+        time.sleep(0.05)
+    progress.empty()
+    return mare_shown
+
+def recommend_stallions(df, mare_name, offspring_index=None, pedigree_graph=None, mare_names=None):
+    # Cached results render at once; otherwise a RelativesJob streams them in.
+    # The job lives in session_state, so reruns (e.g. opening a relative's
+    # stallions) pick up the same job instead of starting over. A job that
+    # failed is dropped, so the next rerun tries again.
+    key = result_key("app", df, mare_name, "kinship", pedigree_graph.max_depth if pedigree_graph else KINSHIP_DEPTH)
+    result = results.get(key) if key is not None else None
+    mare_area, live = st.empty(), st.empty()
+    job = None
+    if result is None:
+        job = st.session_state.get("relatives_job")
+        if job is None or (job.key, job.mare_name) != (key, mare_name):
+            job = RelativesJob(
+                load_executor(), df, mare_name, offspring_index, pedigree_graph, mare_names,
+                key=key, on_result=None if key is None else partial(results.put, key),
+            )
+            st.session_state["relatives_job"] = job
+        mare_shown = stream_relatives(job, mare_area, live)
+        try:
+            result = job.result()
+        except Exception:
+            st.session_state.pop("relatives_job", None)
+            raise
+    else:
+        mare_shown = False
+
+    laps = Laps()
+    if result is None:
+        st.error("Mare not found.")
+        return job
+    if not mare_shown:
+        with mare_area.container():
+            render_mare(result["mare"])
+    with live.container():
+        tabs = render_relatives(result["mare"], result["relatives"])
+    laps.lap("render", tabs=tabs)
+    return job
+
+def recommend_from_service(mare_name):
+    # Thin-client mode: the service scores (and caches) the relatives, in one
+    # batch with whatever other sessions asked for at the same moment.
+    with st.spinner("⏳ Scoring relatives by kinship..."):
+        result = service.relatives(mare_name)
+    laps = Laps()
+    if result is None:
+        st.error("Mare not found.")
+        return None
+    render_mare(result["mare"])
+    tabs = render_relatives(result["mare"], result["relatives"])
+    laps.lap("render", tabs=tabs)
+    return None
+
+if selected_mare is None:
+    st.info("No mare matches that name.")
+else:
+    if st.button("Recommend Stallions"):
+        st.session_state["requested_mare"] = selected_mare
+    if st.session_state.get("requested_mare") == selected_mare:
+        start_time = time.time()
+        misses = results.misses
+        with trace_request("app_render", mare=selected_mare) as trace:
+            if service is None:
+                job = recommend_stallions(df, selected_mare, offspring_index, pedigree_graph, mare_names)
+                trace.fields["cache_hit"] = results.misses == misses
+            else:
+                job = recommend_from_service(selected_mare)
+        st.success(f"✅ Recommendations ready in {time.time() - start_time:.2f} seconds!")
+        cache_stats = results.stats() if service is None else service.metrics()["result_cache"]
+        st.caption(f"Result cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['entries']} entries")
+        if show_timings:
+            with st.expander("🔧 Timing details", expanded=False):
+                for t in (load_trace, job and job.trace, trace):
+                    if t is None:
+                        continue
+                    st.markdown(f"**{t.request}** — {t.total_ms or 0:.1f} ms total")
+                    st.dataframe(pd.DataFrame(t.spans))
@@ -1,172 +1,136 @@
 import pandas as pd
 
+from horse_index import DamOffspringIndex, LineageIndex, NameIndex, cached_index
+from nick_stats import NICK_MIN_STARTERS, NickStats
+from pedigree_engine import KINSHIP_DEPTH, PedigreeGraph
+from profiling import Laps, trace_request
+from result_cache import result_key, results
 
-def recommend_stallions(df, mare_name):
-    df["Birth Date"] = pd.to_datetime(df["Birth Date"], errors="coerce")
+
+RECORD_LABELS = {"nick": "with mares by her sire", "sire": "all mares", "unproven": "not yet proven"}
+
+
+def build_recommendation(df, mare_name, use_cache=True):
+    # Structured result for one mare: {"mare", "error", "stallions"} (plus the
+    # "candidates" sires that were ranked); each stallion carries its summary
+    # fields, production record, and the relative, son and justification behind it.
+    # Memoized per mare and dataset version in result_cache.results.
+    with trace_request("cli", mare=mare_name) as trace:
+        computed = []
+
+        def compute():
+            computed.append(True)
+            return _build_recommendation(df, mare_name)
+
+        key = result_key("cli", df, mare_name, "kinship", KINSHIP_DEPTH, "nicks", NICK_MIN_STARTERS) if use_cache else None
+        recommendation = results.get_or_compute(key, compute)
+        trace.fields["cache_hit"] = not computed
+        return recommendation
+
+
+# The caller's frame -> its copy with Birth Date parsed, so a raw read_csv frame
+# is parsed once and its indexes stay cached under that one copy
+_dated = {}
+
+
+def _with_birth_dates(df):
+    if pd.api.types.is_datetime64_any_dtype(df["Birth Date"]):
+        return df
+    source, dated = _dated.get(id(df), (None, None))
+    if source is not df:
+        dated = df.assign(**{"Birth Date": pd.to_datetime(df["Birth Date"], errors="coerce")})
+        _dated.clear()
+        _dated[id(df)] = (df, dated)
+    return dated
+
+
+def _build_recommendation(df, mare_name):
+    laps = Laps()
+    df = _with_birth_dates(df)
+
+    mare_names = cached_index(NameIndex, df, "Mare")
+    horse_names = cached_index(NameIndex, df)
 
     def get_mare_info(mare_name):
-        mare = df[
-            (df["Horse Name"].str.upper() == mare_name.upper())
-            & (df["Horse Gender"] == "Mare")
-        ]
-        return mare.iloc[0] if not mare.empty else None
+        row = mare_names.lookup(mare_name)
+        return df.iloc[row] if row is not None else None
 
     def calculate_pedigree_match(mare_info, relative_info):
-        fields = [
-            "Sire (Father)",
-            "Dam (Mother)",
-            "Paternal Grandsire",
-            "Paternal Granddam",
-            "Maternal Grandsire",
-            "Maternal Granddam",
-            "Great Grandsire (Sire's Sire)",
-            "Great Granddam (Sire's Dam)",
-            "Great Grandsire (Dam's Sire)",
-            "Great Granddam (Dam's Sire's Dam)",
-            "Great Grandsire (Dam's Dam's Sire)",
-            "Great Granddam (Dam's Dam's Dam)",
-        ]
-        shared = sum(
-            mare_info.get(f) == relative_info.get(f)
-            for f in fields
-            if pd.notna(mare_info.get(f)) and pd.notna(relative_info.get(f))
-        )
-        return round(100 * shared / len(fields), 1)
+        # Wright's coefficient of relationship, in %
+        pedigree = cached_index(PedigreeGraph, df)
+        r = pedigree.relationship(pedigree.node(mare_info["Horse Name"]), pedigree.node(relative_info["Horse Name"]))
+        return round(100 * r, 1)
+
+    lineage = cached_index(LineageIndex, df)
+    offspring_index = cached_index(DamOffspringIndex, df)
+    names = horse_names.names
 
     lineage_levels = [
+        (lambda m: lineage.full_sisters(m), "Full Sister"),
+        (lambda m: lineage.half_sisters(m), "Half Sister"),
+        (lambda m: lineage.sharing("Maternal Granddam", m), "Maternal Granddam Shared"),
+        (lambda m: lineage.sharing("Paternal Granddam", m), "Paternal Granddam Shared"),
         (
-            lambda m, e: df[
-                (df["Horse Gender"] == "Mare")
-                & (df["Sire (Father)"] == m["Sire (Father)"])
-                & (df["Dam (Mother)"] == m["Dam (Mother)"])
-                & (df["Horse Name"] != m["Horse Name"])
-                & (~df["Horse Name"].isin(e))
-            ],
-            "Full Sister",
-        ),
-        (
-            lambda m, e: df[
-                (df["Horse Gender"] == "Mare")
-                & (
-                    (
-                        (df["Sire (Father)"] == m["Sire (Father)"])
-                        & (df["Dam (Mother)"] != m["Dam (Mother)"])
-                    )
-                    | (
-                        (df["Dam (Mother)"] == m["Dam (Mother)"])
-                        & (df["Sire (Father)"] != m["Sire (Father)"])
-                    )
-                )
-                & (~df["Horse Name"].isin(e))
-                & (df["Horse Name"] != m["Horse Name"])
-            ],
-            "Half Sister",
-        ),
-        (
-            lambda m, e: (
-                df[
-                    (df["Horse Gender"] == "Mare")
-                    & (df["Maternal Granddam"] == m["Maternal Granddam"])
-                    & (~df["Horse Name"].isin(e))
-                    & (df["Horse Name"] != m["Horse Name"])
-                ]
-                if pd.notna(m["Maternal Granddam"])
-                else pd.DataFrame()
-            ),
-            "Maternal Granddam Shared",
-        ),
-        (
-            lambda m, e: (
-                df[
-                    (df["Horse Gender"] == "Mare")
-                    & (df["Paternal Granddam"] == m["Paternal Granddam"])
-                    & (~df["Horse Name"].isin(e))
-                    & (df["Horse Name"] != m["Horse Name"])
-                ]
-                if pd.notna(m["Paternal Granddam"])
-                else pd.DataFrame()
-            ),
-            "Paternal Granddam Shared",
-        ),
-        (
-            lambda m, e: (
-                df[
-                    (df["Horse Gender"] == "Mare")
-                    & (
-                        df["Great Granddam (Dam's Dam's Dam)"]
-                        == m["Great Granddam (Dam's Dam's Dam)"]
-                    )
-                    & (~df["Horse Name"].isin(e))
-                    & (df["Horse Name"] != m["Horse Name"])
-                ]
-                if pd.notna(m["Great Granddam (Dam's Dam's Dam)"])
-                else pd.DataFrame()
-            ),
+            lambda m: lineage.sharing("Great Granddam (Dam's Dam's Dam)", m),
             "Great Maternal Granddam Shared",
         ),
         (
-            lambda m, e: (
-                df[
-                    (df["Horse Gender"] == "Mare")
-                    & (
-                        df["Great Granddam (Sire's Dam's Dam)"]
-                        == m["Great Granddam (Sire's Dam's Dam)"]
-                    )
-                    & (~df["Horse Name"].isin(e))
-                    & (df["Horse Name"] != m["Horse Name"])
-                ]
-                if pd.notna(m["Great Granddam (Sire's Dam's Dam)"])
-                else pd.DataFrame()
-            ),
+            lambda m: lineage.sharing("Great Granddam (Sire's Dam's Dam)", m),
             "Great Paternal Granddam Shared",
         ),
     ]
 
     def get_offspring(mare_names):
-        return df[
-            (df["Dam (Mother)"].isin(mare_names)) & (df["Total Earnings (USD)"] > 0)
-        ]
+        offspring = offspring_index.offspring_of(mare_names)
+        return offspring[offspring["Total Earnings (USD)"] > 0]
 
+    laps.lap("indexes", rows=len(df))
     mare_info = get_mare_info(mare_name)
+    laps.lap("mare_lookup")
     if mare_info is None:
-        print(f"❌ Mare '{mare_name}' not found or is not a mare.")
-        return
+        return {"mare": None, "error": f"Mare '{mare_name}' not found or is not a mare.", "stallions": []}
 
-    collected_offspring = pd.DataFrame()
+    offspring_frames = []
+    offspring_sires = set()
     relationships = []
-    exclude = [mare_info["Horse Name"]]
+    exclude = {mare_info["Horse Name"]}
+
+    def collect(offspring):
+        offspring_frames.append(offspring)
+        offspring_sires.update(None if pd.isna(s) else s for s in offspring["Sire (Father)"])
 
     own_offspring = get_offspring([mare_info["Horse Name"]])
     if not own_offspring.empty:
         relationships += [
             (mare_info["Horse Name"], "Self") for _ in own_offspring["Horse Name"]
         ]
-        collected_offspring = pd.concat([collected_offspring, own_offspring])
+        collect(own_offspring)
 
+    tiers = 0
     for get_relatives, label in lineage_levels:
-        if (
-            "Sire (Father)" not in collected_offspring.columns
-            or len(collected_offspring["Sire (Father)"].unique()) < 3
-        ):
-            relatives = get_relatives(mare_info, exclude)
-            if "Horse Name" in relatives.columns:
-                relationships += [(m, label) for m in relatives["Horse Name"]]
-                exclude += list(relatives["Horse Name"])
-                offspring = get_offspring(relatives["Horse Name"])
-                collected_offspring = pd.concat([collected_offspring, offspring])
+        if len(offspring_sires) < 3:
+            tiers += 1
+            relatives = [n for n in names[get_relatives(mare_info)] if n not in exclude]
+            relationships += [(m, label) for m in relatives]
+            exclude.update(relatives)
+            collect(get_offspring(relatives))
         else:
             break
 
+    collected_offspring = pd.concat(offspring_frames) if offspring_frames else pd.DataFrame()
+    laps.lap("lineage_cascade", tiers=tiers, relatives=len(exclude) - 1, offspring_rows=len(collected_offspring))
     if collected_offspring.empty:
-        print("❌ No offspring with earnings found from mare or relatives.")
-        return
+        return {"mare": mare_info, "error": "No offspring with earnings found from mare or relatives.", "stallions": []}
 
-    # Keep only top 3 unique stallions by top earning offspring
-    collected_offspring = (
-        collected_offspring.sort_values(by="Total Earnings (USD)", ascending=False)
-        .drop_duplicates("Sire (Father)")
-        .head(3)
+    # Every sire in the family is a candidate; the top 3 are picked by their
+    # record with mares by her sire (the nick) in the precomputed table, or
+    # their overall record, with the family's best son kept as the example.
+    best_sons = collected_offspring.sort_values(by="Total Earnings (USD)", ascending=False).drop_duplicates(
+        "Sire (Father)"
     )
+    candidates = best_sons["Sire (Father)"].dropna().tolist()
+    ranking = cached_index(NickStats, df).rank(candidates, mare_info["Sire (Father)"], limit=3)
+    collected_offspring = best_sons[best_sons["Sire (Father)"].isin(ranking.index)]
 
     rel_df = pd.DataFrame(relationships, columns=["Mare Name", "Relationship"])
     result = pd.merge(
@@ -179,44 +143,13 @@ def recommend_stallions(df, mare_name):
         how="left",
     ).drop(columns=["Mare Name"])
 
-    stallion_summary = (
-        result.groupby("Sire (Father)")
-        .agg(Top_Son_Earnings=("Total Earnings (USD)", "max"))
-        .sort_values(by="Top_Son_Earnings", ascending=False)
-        .reset_index()
-    )
-
-    stallion_details = df[df["Horse Gender"] == "Stallion"][
-        ["Horse Name", "Horse Registration Number", "Birth Date", "Pedigree Link"]
-    ]
-    stallion_summary = pd.merge(
-        stallion_summary,
-        stallion_details,
-        left_on="Sire (Father)",
-        right_on="Horse Name",
-        how="left",
-    ).drop(columns=["Horse Name"])
-
-    print("\n🟩 INPUT MARE INFO:")
-    print(f"• Name:                 {mare_info['Horse Name']}")
-    print(f"• Registration #:       {mare_info['Horse Registration Number']}")
-    print(f"• Birth Date:           {mare_info['Birth Date'].date()}")
-    print(f"• Sire (Father):        {mare_info['Sire (Father)']}")
-    print(f"• Dam (Mother):         {mare_info['Dam (Mother)']}")
-    print(f"• Maternal Granddam:    {mare_info['Maternal Granddam']}")
-    print(f"• Paternal Granddam:    {mare_info['Paternal Granddam']}")
-    print(f"• Pedigree Link:        {mare_info['Pedigree Link']}")
-
-    print("\n⭐ TOP STALLIONS (Proven sires):\n")
-    for idx, row in stallion_summary.iterrows():
-        print(f"{idx+1}. {row['Sire (Father)']}")
-        print(f"   • Earnings from son:    ${row['Top_Son_Earnings']:,.2f}")
-        print(f"   • Registration #:       {row['Horse Registration Number']}")
-        print(
-            f"   • Birth Date:           {row['Birth Date'].date() if pd.notna(row['Birth Date']) else 'N/A'}"
-        )
-        print(f"   • Pedigree Link:        {row['Pedigree Link']}")
+    top_son = dict(zip(collected_offspring["Sire (Father)"].astype(object), collected_offspring["Total Earnings (USD)"]))
+    stallion_summary = ranking.rename_axis("Sire (Father)").reset_index()
+    stallion_summary["Top_Son_Earnings"] = stallion_summary["Sire (Father)"].map(top_son)
+    laps.lap("stallion_ranking", stallions=len(stallion_summary))
 
+    stallions = []
+    for _, row in stallion_summary.iterrows():
         r = result[result["Sire (Father)"] == row["Sire (Father)"]].iloc[0]
         dam = r["Dam (Mother)"]
         son = r["Horse Name"]
@@ -227,7 +160,7 @@ def recommend_stallions(df, mare_name):
         if rel == "Full Sister":
             common = f"They share both sire ({mare_info['Sire (Father)']}) and dam ({mare_info['Dam (Mother)']})"
         elif rel == "Half Sister":
-            relative_row = df[df["Horse Name"] == dam].iloc[0]
+            relative_row = df.iloc[horse_names.first_exact(dam)]
             if relative_row["Sire (Father)"] == mare_info["Sire (Father)"]:
                 common = f"They share the same sire: {mare_info['Sire (Father)']}"
             else:
@@ -236,7 +169,7 @@ def recommend_stallions(df, mare_name):
         if rel == "Self":
             desc = f"{dam} is the mare herself. She has previously produced {son}, who earned ${earnings:,.2f}. This confirms that the pairing with stallion {row['Sire (Father)']} has already led to successful performance."
         else:
-            relative_info = df[df["Horse Name"] == dam].iloc[0]
+            relative_info = df.iloc[horse_names.first_exact(dam)]
             pedigree_percent = calculate_pedigree_match(mare_info, relative_info)
             if rel == "Full Sister":
                 desc = f"{dam} is a full sister of {mare_info['Horse Name']}. {common}. This indicates high genetic similarity and pedigree overlap."
@@ -255,6 +188,74 @@ def recommend_stallions(df, mare_name):
             else:
                 desc = f"{dam} is a relative of {mare_info['Horse Name']}."
 
-            desc += f" Notably, {dam} produced an offspring named {son}, who earned ${earnings:,.2f}. This success suggests that the stallion {row['Sire (Father)']} is a promising match. They also share approximately {pedigree_percent}% of their known pedigree."
+            desc += f" Notably, {dam} produced an offspring named {son}, who earned ${earnings:,.2f}. This success suggests that the stallion {row['Sire (Father)']} is a promising match. Their coefficient of relationship is approximately {pedigree_percent}%."
+
+        sire = row["Sire (Father)"]
+        if row["basis"] == "unproven":
+            desc += f" {sire} has only {int(row['starters'])} recorded starters, so his record is not yet proven."
+        else:
+            desc += (
+                f" Bred to mares by {mare_info['Sire (Father)']}, {sire} has"
+                if row["basis"] == "nick"
+                else f" Across all his mares, {sire} has"
+            )
+            desc += f" {int(row['starters'])} starters ({int(row['earners'])} earners) averaging ${row['earnings_per_starter']:,.2f} per starter."
+
+        stallions.append(
+            {
+                "Sire (Father)": row["Sire (Father)"],
+                "Top_Son_Earnings": row["Top_Son_Earnings"],
+                "Horse Registration Number": row["Horse Registration Number"],
+                "Birth Date": row["Birth Date"],
+                "Pedigree Link": row["Pedigree Link"],
+                "Record Basis": row["basis"],
+                "Starters": int(row["starters"]),
+                "Earners": int(row["earners"]),
+                "Median Earnings": row["median_earnings"],
+                "Earnings per Starter": row["earnings_per_starter"],
+                "Relative": dam,
+                "Relationship": rel,
+                "Offspring": son,
+                "Offspring Earnings": earnings,
+                "Justification": desc,
+            }
+        )
+
+    laps.lap("justification")
+    return {"mare": mare_info, "error": None, "stallions": stallions, "candidates": candidates}
+
+
+def recommend_stallions(df, mare_name, use_cache=True):
+    print_recommendation(build_recommendation(df, mare_name, use_cache))
+
+
+def print_recommendation(recommendation):
+    mare_info = recommendation["mare"]
+    if recommendation["error"]:
+        print(f"❌ {recommendation['error']}")
+        return
+
+    print("\n🟩 INPUT MARE INFO:")
+    print(f"• Name:                 {mare_info['Horse Name']}")
+    print(f"• Registration #:       {mare_info['Horse Registration Number']}")
+    print(f"• Birth Date:           {mare_info['Birth Date'].date()}")
+    print(f"• Sire (Father):        {mare_info['Sire (Father)']}")
+    print(f"• Dam (Mother):         {mare_info['Dam (Mother)']}")
+    print(f"• Maternal Granddam:    {mare_info['Maternal Granddam']}")
+    print(f"• Paternal Granddam:    {mare_info['Paternal Granddam']}")
+    print(f"• Pedigree Link:        {mare_info['Pedigree Link']}")
 
-        print(f"\n📘 JUSTIFICATION for stallion {row['Sire (Father)']}:\n   {desc}\n")
+    print("\n⭐ TOP STALLIONS (Proven sires):\n")
+    for idx, row in enumerate(recommendation["stallions"]):
+        print(f"{idx+1}. {row['Sire (Father)']}")
+        print(f"   • Earnings from son:    ${row['Top_Son_Earnings']:,.2f}")
+        print(f"   • Registration #:       {row['Horse Registration Number']}")
+        print(
+            f"   • Birth Date:           {row['Birth Date'].date() if pd.notna(row['Birth Date']) else 'N/A'}"
+        )
+        print(f"   • Pedigree Link:        {row['Pedigree Link']}")
+        print(
+            f"   • Starters / earners:   {row['Starters']} / {row['Earners']} "
+            f"(${row['Earnings per Starter']:,.2f} per starter, {RECORD_LABELS[row['Record Basis']]})"
+        )
+        print(f"\n📘 JUSTIFICATION for stallion {row['Sire (Father)']}:\n   {row['Justification']}\n")
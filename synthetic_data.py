@@ -0,0 +1,91 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from pedigree_engine import PEDIGREE_COLUMNS
+
+_WORDS = np.array([
+    "Swift", "Golden", "Midnight", "Royal", "Silver", "Dancing", "Storm", "Lucky", "Wild", "Noble",
+    "Dream", "Star", "Fire", "Shadow", "Thunder", "Rose", "Spirit", "Legend", "River", "Queen",
+    "King", "Jet", "Blue", "Ruby", "Sky", "Diamond", "Magic", "Brave", "Dash", "Echo",
+])
+
+
+def generate_registry(n_horses, seed=0, first_year=1960, last_year=2020):
+    # Deterministic Horse_Data_Cleaned.csv-shaped registry in birth order: a founder cohort with no recorded
+    # parents, then yearly foal crops by sires/dams aged 3-20. Sire popularity
+    # and mare-family quality are heavy tailed and heritable, so a few stallions
+    # dominate and earnings cluster in families. Pedigree slots are filled from
+    # the parents' own rows, generation by generation (sire's half first).
+    rng = np.random.default_rng(seed)
+    n_founders = max(50, n_horses // 20)
+    years = first_year + np.arange(n_horses) * (last_year - first_year + 1) // n_horses
+    gender = rng.choice(np.array(["Stallion", "Mare", "Gelding"]), size=n_horses, p=[0.4, 0.5, 0.1])
+    quality = rng.pareto(1.5, size=n_horses)
+    ancestors = np.full((n_horses, len(PEDIGREE_COLUMNS)), -1, dtype=np.int64)
+
+    for year in np.unique(years):
+        crop = np.flatnonzero(years == year)
+        crop = crop[crop >= n_founders]
+        eligible = (years <= year - 3) & (years >= year - 20)
+        sires = np.flatnonzero(eligible & (gender == "Stallion"))
+        dams = np.flatnonzero(eligible & (gender == "Mare"))
+        if len(crop) == 0 or len(sires) == 0 or len(dams) == 0:
+            continue
+        sire_weight = quality[sires] + 0.05
+        dam_weight = quality[dams] + 0.5
+        sire = rng.choice(sires, size=len(crop), p=sire_weight / sire_weight.sum())
+        dam = rng.choice(dams, size=len(crop), p=dam_weight / dam_weight.sum())
+        quality[crop] = 0.4 * (quality[sire] + quality[dam]) + rng.pareto(3.0, size=len(crop))
+        ancestors[crop, 0], ancestors[crop, 1] = sire, dam
+        lo = 2
+        for width in (2, 4, 8):
+            ancestors[crop, lo:lo + width] = ancestors[sire, lo - width:lo]
+            ancestors[crop, lo + width:lo + 2 * width] = ancestors[dam, lo - width:lo]
+            lo += 2 * width
+
+    first, second = rng.integers(0, len(_WORDS), size=(2, n_horses))
+    names = np.char.add(np.char.add(_WORDS[first], " "), _WORDS[second])
+    names = np.char.add(np.char.add(names, " "), np.char.zfill(np.arange(n_horses).astype(str), 7))
+    registration = np.char.add("R", np.char.zfill(np.arange(n_horses).astype(str), 8))
+
+    started = rng.random(n_horses) < 0.45
+    earnings = np.where(started, np.round(rng.lognormal(9.0, 1.6, n_horses) * (1 + 2 * np.log1p(quality)), 2), 0.0)
+    birth = (years - 1970).astype("datetime64[Y]").astype("datetime64[D]") + rng.integers(0, 365, n_horses)
+
+    df = pd.DataFrame({
+        "Horse Name": names.astype(object),
+        "Horse Gender": gender,
+        "Horse Registration Number": registration.astype(object),
+        "Birth Date": pd.to_datetime(birth).strftime("%Y-%m-%d"),
+        "Pedigree Link": np.char.add("https://example.org/pedigree/", registration).astype(object),
+        "Total Earnings (USD)": earnings,
+    })
+    with_missing = np.append(names.astype(object), np.nan)
+    for j, col in enumerate(PEDIGREE_COLUMNS):
+        df[col] = with_missing[ancestors[:, j]]
+    # The registry's extra great-granddam slot, filled like the one through the sire's dam
+    df["Great Granddam (Sire's Dam)"] = df["Great Granddam (Sire's Dam's Dam)"]
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic Horse_Data_Cleaned.csv.")
+    parser.add_argument("--horses", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--years", type=int, nargs=2, default=[1960, 2020], metavar=("FIRST", "LAST"),
+        help="birth years spanned; e.g. 1900 2020 for a ~20-generation pedigree",
+    )
+    parser.add_argument("--output", default=os.path.join("Data", "synthetic", "Horse_Data_Cleaned.csv"))
+    args = parser.parse_args(argv)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    generate_registry(args.horses, args.seed, *args.years).to_csv(args.output, index=False)
+    print(f"✅ {args.horses:,} synthetic horses written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()